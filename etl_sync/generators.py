@@ -1,18 +1,57 @@
 from __future__ import print_function
 
+import hashlib
+import heapq
+import struct
+from array import array
 from builtins import str as text
 from collections import OrderedDict
-from hashlib import md5
+from datetime import datetime
 from typing import List
 
+import django
+from django.conf import settings
 from django.core.exceptions import FieldError, ValidationError
-from django.db.models import FieldDoesNotExist, ManyToOneRel, Q
+from django.db import connections, router, transaction
+from django.db.models import ManyToManyRel, ManyToOneRel, Model, Q
+try:
+    from django.core.exceptions import FieldDoesNotExist
+except ImportError:
+    # Django 1.7
+    from django.db.models import FieldDoesNotExist
 from django.forms import DateTimeField
+from django.forms.utils import from_current_timezone
+from django.utils import timezone
 from future.utils import iteritems
 from six import binary_type, text_type
 
 from etl_sync.types import GenerationStatus
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# length prefix of hashed values, -1 for None
+LENGTH = struct.Struct('>i')
+# marks datetime.fromisoformat among the datetime input formats
+ISO_FORMAT = object()
+# django.contrib.gis.geos, see get_geos
+geos = None
+
+
+def get_geos():
+    """
+    Returns django.contrib.gis.geos, imported on first use since GEOS is
+    only required for geometry fields.
+    """
+    global geos
+    if geos is None:
+        from django.contrib.gis import geos as module
+        geos = module
+    return geos
+
 
 def get_internal_type(field):
     """
@@ -83,6 +122,350 @@ def get_unique_string_fields(model_class):
         field.unique]
 
 
+class RelatedCache(object):
+    """
+    Bounded cache of related instances resolved by prepare_fk with least
+    recently used eviction. Keys combine the related model, the generator
+    options, and the normalized value or dictionary. Entries pointing to
+    a record are dropped whenever a generator sharing the cache updates
+    that record. Entries added since the last commit are dropped by
+    rollback, since the records they point to may not exist anymore.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.keys = {}
+        self.journal = []
+        self.hits = 0
+        self.misses = 0
+
+    def freeze(self, value):
+        if isinstance(value, dict):
+            return tuple(sorted(
+                (key, self.freeze(item)) for key, item in iteritems(value)))
+        if isinstance(value, (list, tuple)):
+            return tuple(self.freeze(item) for item in value)
+        if isinstance(value, Model):
+            return (value.__class__, value.pk)
+        return value
+
+    def make_key(self, model_class, options, value):
+        """
+        Returns the cache key or None if the value can't be cached.
+        """
+        if isinstance(value, Model):
+            return None
+        key = (model_class, self.freeze(options), self.freeze(value))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key):
+        try:
+            instance = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return instance
+
+    def set(self, key, instance):
+        if key in self.entries:
+            self.discard(key, self.entries[key])
+        self.entries[key] = instance
+        self.entries.move_to_end(key)
+        self.journal.append(key)
+        self.keys.setdefault(
+            (instance.__class__, instance.pk), set()).add(key)
+        while len(self.entries) > self.maxsize:
+            old_key, old = self.entries.popitem(last=False)
+            self.discard(old_key, old)
+
+    def discard(self, key, instance):
+        keys = self.keys.get((instance.__class__, instance.pk))
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del self.keys[(instance.__class__, instance.pk)]
+
+    def invalidate(self, instance):
+        """
+        Drops all entries pointing to the record of instance.
+        """
+        for key in self.keys.pop((instance.__class__, instance.pk), ()):
+            self.entries.pop(key, None)
+
+    def commit(self):
+        self.journal = []
+
+    def rollback(self, mark=0):
+        """
+        Drops the entries added since the last commit, or since the
+        journal had mark entries.
+        """
+        for key in self.journal[mark:]:
+            instance = self.entries.pop(key, None)
+            if instance is not None:
+                self.discard(key, instance)
+        del self.journal[mark:]
+
+    def clear(self):
+        self.entries.clear()
+        self.keys.clear()
+        self.journal = []
+
+
+class PersistenceIndex(object):
+    """
+    In-memory index of existing records by persistence key. Keys are
+    built by BaseGenerator.get_persistence_keys. Records are fetched with
+    a few IN queries per persistence criterion for a whole batch instead
+    of one query per record.
+    """
+    chunk_size = 500
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.fetched = set()
+        self.criteria = set()
+        self.instances = {}
+
+    def load(self, items):
+        """
+        Fetches all records matching the persistence criteria of the
+        given dictionaries.
+
+        Args:
+            items: Iterable of (dic, lookup) tuples.
+        """
+        wanted = OrderedDict()
+        for dic, lookup in items:
+            for criterion in lookup or []:
+                for key in self.generator.get_persistence_keys(
+                        dic, [criterion]) or []:
+                    if key not in self.fetched:
+                        wanted.setdefault(key[0], set()).add(key[1])
+        for names, values in iteritems(wanted):
+            self.fetch(names, list(values))
+
+    def fetch(self, names, values):
+        meta = self.generator.model_class._meta
+        attnames = [meta.get_field(name).attname for name in names]
+        manager = self.generator.model_class.objects
+        size = max(1, self.chunk_size // len(names))
+        self.criteria.add(names)
+        for start in range(0, len(values), size):
+            chunk = values[start:start + size]
+            if len(names) == 1:
+                qs = manager.filter(**{
+                    attnames[0] + '__in': [value[0] for value in chunk]})
+            else:
+                query = Q()
+                for value in chunk:
+                    query |= Q(**dict(zip(attnames, value)))
+                qs = manager.filter(query)
+            for instance in qs:
+                self.add(instance, [names])
+            self.fetched.update((names, value) for value in chunk)
+
+    def add(self, instance, criteria=None):
+        """
+        Registers an instance under its keys.
+        """
+        meta = self.generator.model_class._meta
+        for names in criteria or self.criteria:
+            values = tuple(
+                self.generator.get_key_value(
+                    name, getattr(instance, meta.get_field(name).attname))
+                for name in names)
+            if any(value is None for value in values):
+                continue
+            instances = self.instances.setdefault((names, values), [])
+            if not any(item is instance for item in instances):
+                instances.append(instance)
+
+    def get(self, dic, lookup):
+        """
+        Returns the list of indexed instances matching dic, or None if
+        the index cannot answer the lookup and the database needs to be
+        queried.
+        """
+        keys = self.generator.get_persistence_keys(dic, lookup)
+        if not keys or any(key not in self.fetched for key in keys):
+            return None
+        ret = []
+        for key in keys:
+            for instance in self.instances.get(key, []):
+                if not any(item is instance for item in ret):
+                    ret.append(instance)
+        return ret
+
+
+class HashIndex(object):
+    """
+    Compact in-memory index of the hashes of all records of a model,
+    used by HashMixin to recognize unchanged records without querying.
+    Hex digests of the preloaded records are stored as one sorted byte
+    string alongside an array of primary keys, about 24 bytes per record
+    for md5 hashes. Records written later are kept in a dictionary,
+    entries added since the last commit are reverted by rollback.
+    """
+    chunk_size = 10000
+
+    def __init__(self, model_class, hashfield):
+        self.model_class = model_class
+        self.hashfield = hashfield
+        self.width = 0
+        self.digests = b''
+        self.pks = []
+        self.added = {}
+        self.current = {}
+        self.journal = []
+
+    def encode(self, value):
+        try:
+            return bytes(bytearray.fromhex(value))
+        except (TypeError, ValueError):
+            return None
+
+    def load(self):
+        """
+        Reads the hashes and primary keys of all records, in chunks with
+        a server-side cursor where the backend supports it. Each chunk
+        is sorted and packed right away, the packed chunks are merged,
+        so the peak memory use is about twice the size of the index.
+        """
+        qs = self.model_class.objects.exclude(
+            **{self.hashfield + '__isnull': True}).values_list(
+                self.hashfield, 'pk')
+        if django.VERSION >= (2, 0):
+            items = qs.iterator(chunk_size=self.chunk_size)
+        else:
+            items = qs.iterator()
+        runs = []
+        chunk = []
+        for value, pk in items:
+            digest = self.encode(value)
+            if not self.width and digest:
+                self.width = len(digest)
+            if digest and len(digest) == self.width:
+                chunk.append((digest, pk))
+                if len(chunk) >= self.chunk_size:
+                    runs.append(self.pack(chunk))
+                    chunk = []
+            else:
+                self.add(value, pk)
+        if chunk:
+            runs.append(self.pack(chunk))
+        digests = bytearray()
+        if any(isinstance(pks, list) for _, pks in runs):
+            pks = []
+        else:
+            pks = array('q')
+        for digest, pk in heapq.merge(*[self.unpack(run) for run in runs]):
+            digests += digest
+            pks.append(pk)
+        self.digests = digests
+        self.pks = pks
+        self.journal = []
+
+    def pack(self, chunk):
+        """
+        Returns a sorted chunk of (digest, pk) tuples as byte string of
+        digests and array of primary keys.
+        """
+        chunk.sort()
+        pks = [pk for _, pk in chunk]
+        try:
+            pks = array('q', pks)
+        except (TypeError, OverflowError):
+            # e.g. UUID primary keys
+            pass
+        return b''.join(digest for digest, _ in chunk), pks
+
+    def unpack(self, run):
+        digests, pks = run
+        width = self.width
+        for position, pk in enumerate(pks):
+            yield digests[position * width:(position + 1) * width], pk
+
+    def get(self, value):
+        """
+        Returns the primary key of the record with hash value or None.
+        """
+        pk = self.added.get(value)
+        if pk is not None:
+            return pk if self.current.get(pk) == value else None
+        digest = self.encode(value)
+        if digest is None or len(digest) != self.width:
+            return None
+        width = self.width
+        low, high = 0, len(self.pks)
+        while low < high:
+            middle = (low + high) // 2
+            if self.digests[middle * width:(middle + 1) * width] < digest:
+                low = middle + 1
+            else:
+                high = middle
+        if (low < len(self.pks) and
+                self.digests[low * width:(low + 1) * width] == digest):
+            pk = self.pks[low]
+            # the record was changed since loading
+            return None if pk in self.current else pk
+        return None
+
+    def add(self, value, pk):
+        """
+        Registers the hash of a created or updated record.
+        """
+        if value is not None:
+            self.journal.append(
+                (value, self.added.get(value), pk, self.current.get(pk)))
+            self.added[value] = pk
+            self.current[pk] = value
+
+    def commit(self):
+        self.journal = []
+
+    def rollback(self, mark=0):
+        """
+        Reverts the hashes added since the last commit, or since the
+        journal had mark entries.
+        """
+        for value, old_pk, pk, old_value in reversed(self.journal[mark:]):
+            if old_pk is None:
+                self.added.pop(value, None)
+            else:
+                self.added[value] = old_pk
+            if old_value is None:
+                self.current.pop(pk, None)
+            else:
+                self.current[pk] = old_value
+        del self.journal[mark:]
+
+
+class BatchRow(object):
+    """
+    Holds the state of a single record while a batch is processed
+    by BaseGenerator.get_instances.
+    """
+
+    def __init__(self, persistence, create, update):
+        self.persistence = persistence
+        self.create = create
+        self.update = update
+        self.dic = None
+        self.qs = None
+        self.back_refs = {}
+        self.related_instances = {}
+        self.instance = None
+        self.res = None
+
+
 class BaseGenerator(object):
     persistence = None
 
@@ -93,7 +476,14 @@ class BaseGenerator(object):
         self.create = options.get('create', True)
         self.update = options.get('update', True)
         self.related_field = options.get('related_field')
+        self.related_cache = options.get('related_cache')
+        self.remove_related = options.get('remove_related', False)
+        self.upsert = options.get('upsert', False)
+        self.generators = options.get('generators')
+        if self.generators is None:
+            self.generators = {}
         self.res = None
+        self.persistence_index = None
         self.persistence = (self.persistence or persistence or
                             get_persistence(self.model_class))
         if isinstance(self.persistence, (text_type, binary_type)):
@@ -104,10 +494,49 @@ class BaseGenerator(object):
             for field in self.model_fields])
         self.unique_string_fields = get_unique_string_fields(self.model_class)
 
+    def get_generator(self, model_class, options=None, generator_class=None):
+        """
+        Returns a generator for related records of model_class. Generators
+        are created once per class, model, and options and are shared
+        with all nested generators through the registry of the top level
+        generator.
+        """
+        generator_class = generator_class or self.__class__
+        options = options or {}
+        key = (generator_class, model_class,
+               tuple(sorted(iteritems(options))))
+        try:
+            return self.generators[key]
+        except KeyError:
+            pass
+        options = dict(options, generators=self.generators,
+                       related_cache=self.related_cache)
+        generator = generator_class(model_class, options=options)
+        self.generators[key] = generator
+        return generator
+
     def get_persistence_query(self, dic, persistence, update):
         return dic, self.get_from_db(dic, persistence), update
 
+    def get_persistence_lookups(self, persistence):
+        """
+        Returns all criteria get_persistence_query looks up for the
+        given persistence. Used to build the persistence index.
+        """
+        if isinstance(persistence, (text_type, binary_type)):
+            return [persistence]
+        return list(persistence or [])
+
     def get_from_db(self, dic, lookup):
+        """
+        Returns the records matching any of the lookup criteria. Consults
+        the persistence index first if one is set, in that case the
+        result is a list of instances.
+        """
+        if self.persistence_index is not None:
+            instances = self.persistence_index.get(dic, lookup)
+            if instances is not None:
+                return instances
         if lookup:
             query = Q()
             for field in lookup:
@@ -142,14 +571,208 @@ class BaseGenerator(object):
 
         Args:
             dic(dict): Data dictionary.
-            qs(QuerySet): A django queryset.
+            qs(QuerySet or list): A django queryset or a list of instances
+                from the persistence index.
 
         Returns:
             Model instance: First model instance.
         """
+        if isinstance(qs, list):
+            qs = self.model_class.objects.filter(
+                pk__in=[instance.pk for instance in qs])
         qs.update(**dic)
         return qs[0]
 
+    def bulk_create_in_db(self, instances):
+        """
+        Inserts unsaved instances. Instances keep their primary key
+        only on backends that return it from bulk inserts.
+        """
+        return self.model_class.objects.bulk_create(instances)
+
+    def bulk_update_in_db(self, instances, fields):
+        """
+        Writes the given fields of already existing instances.
+        """
+        manager = self.model_class.objects
+        if hasattr(manager, 'bulk_update'):
+            return manager.bulk_update(instances, fields)
+        # Django < 2.2
+        for instance in instances:
+            manager.filter(pk=instance.pk).update(**{
+                field: getattr(instance, field) for field in fields})
+
+    def upsert_in_db(self, instances, unique_fields, update_fields):
+        """
+        Inserts instances or, if a record with the same unique_fields
+        exists, updates its update_fields, in one statement per batch.
+        Without update_fields, existing records are left alone.
+        """
+        if not update_fields:
+            return self.model_class.objects.bulk_create(
+                instances, ignore_conflicts=True)
+        return self.model_class.objects.bulk_create(
+            instances, update_conflicts=True, unique_fields=unique_fields,
+            update_fields=update_fields)
+
+    def fetch_pks(self, instances, unique_fields):
+        """
+        Sets the primary keys of upserted instances, which Django
+        before 5.0 and backends without RETURNING don't return, by
+        looking them up by unique_fields in one query.
+        """
+        if not instances:
+            return
+        names = [self.model_class._meta.get_field(name).attname
+                 for name in unique_fields]
+        query = Q()
+        for instance in instances:
+            query |= Q(**{name: getattr(instance, name) for name in names})
+        pks = dict(
+            (tuple(values[1:]), values[0]) for values in
+            self.model_class.objects.filter(query).values_list(
+                'pk', *names))
+        for instance in instances:
+            instance.pk = pks.get(
+                tuple(getattr(instance, name) for name in names))
+            if instance.pk is not None:
+                instance._state.adding = False
+
+    def can_bulk_create(self, upsert=False):
+        """
+        True if bulk inserts return primary keys, which are required
+        to create relationships of the new records.
+        """
+        if upsert and django.VERSION < (5, 0):
+            return False
+        features = connections[
+            router.db_for_write(self.model_class)].features
+        return (
+            getattr(features, 'can_return_rows_from_bulk_insert', False) or
+            getattr(features, 'can_return_ids_from_bulk_insert', False))
+
+    def get_upsert_fields(self, rows):
+        """
+        Returns the conflict target for writing rows with upsert_in_db,
+        or None if upserts are disabled, not supported by the backend,
+        or the rows don't share a single persistence criterion backed by
+        a unique constraint.
+        """
+        if not self.upsert or self.model_class._meta.parents:
+            return None
+        features = connections[
+            router.db_for_write(self.model_class)].features
+        if not getattr(features, 'supports_update_conflicts_with_target',
+                       False):
+            return None
+        return self.get_conflict_fields(rows)
+
+    def get_conflict_fields(self, rows):
+        """
+        Returns the fields of the unique field, unique_together or unique
+        constraint all rows are persisted by, or None if there is none.
+        """
+        criteria = set(
+            tuple(self.get_persistence_lookups(row.persistence))
+            for row in rows)
+        if len(criteria) != 1:
+            return None
+        criterion = criteria.pop()
+        if len(criterion) != 1:
+            return None
+        names = criterion[0]
+        if isinstance(names, (text_type, binary_type)):
+            try:
+                field = self.model_class._meta.get_field(names)
+            except FieldDoesNotExist:
+                return None
+            return [names] if getattr(field, 'unique', False) else None
+        meta = self.model_class._meta
+        constraints = [tuple(item) for item in meta.unique_together]
+        constraints.extend(
+            tuple(constraint.fields) for constraint in getattr(
+                meta, 'total_unique_constraints', []))
+        return list(names) if tuple(names) in constraints else None
+
+    def get_key_value(self, name, value):
+        """
+        Normalizes value of field name for use in a persistence key.
+        Related instances are reduced to the value of the target field.
+        """
+        field = self.model_class._meta.get_field(name)
+        if not getattr(field, 'concrete', False) or field.many_to_many:
+            raise FieldDoesNotExist(name)
+        if field.is_relation:
+            if isinstance(value, Model):
+                value = getattr(value, field.target_field.attname)
+            field = field.target_field
+        try:
+            return field.to_python(value)
+        except ValidationError:
+            return value
+
+    def get_persistence_keys(self, dic, lookup):
+        """
+        Returns hashable keys for the persistence criteria in lookup
+        which are met by dic, following the rules of get_from_db.
+        Returns None if a criterion cannot be expressed as a key, e.g.
+        for lookups spanning relations.
+        """
+        if isinstance(lookup, (text_type, binary_type)):
+            lookup = [lookup]
+        keys = []
+        for field in lookup or []:
+            names = tuple(field) if isinstance(field, (list, tuple)) else (
+                field,)
+            values = [dic.get(name, None) for name in names]
+            if len(names) == 1 and not values[0]:
+                continue
+            if all(value is None for value in values):
+                continue
+            if any(value is None for value in values):
+                return None
+            try:
+                key = (names, tuple(
+                    self.get_key_value(name, value)
+                    for name, value in zip(names, values)))
+                hash(key)
+            except (FieldDoesNotExist, TypeError):
+                return None
+            keys.append(key)
+        return keys
+
+    def create_back_refs(self, instance, back_refs):
+        for field, data in back_refs.items():
+            if not isinstance(data, list):
+                data = [data]
+            for datum in data:
+                datum[field.field.name] = instance
+                self.get_generator(field.related_model).get_instance(datum)
+
+    def create_back_refs_batch(self, items):
+        """
+        Batch version of create_back_refs. Collects the child records of
+        all instances per back reference and writes them with a single
+        get_instances call of the child generator. A rejected child
+        raises its exception, which rejects the batch.
+
+        Args:
+            items: Iterable of (instance, back_refs) tuples.
+        """
+        children = OrderedDict()
+        for instance, back_refs in items:
+            for field, data in iteritems(back_refs):
+                if not isinstance(data, list):
+                    data = [data]
+                children.setdefault(field, []).extend(
+                    dict(datum, **{field.field.name: instance})
+                    for datum in data)
+        for field, data in iteritems(children):
+            generator = self.get_generator(field.related_model)
+            for _, res in generator.get_instances(data):
+                if isinstance(res, Exception):
+                    raise res
+
     def instance_from_dic(self, dic):
         persistence = dic.pop('etl_persistence', self.persistence)
         create = dic.pop('etl_create', self.create)
@@ -162,6 +785,8 @@ class BaseGenerator(object):
             if update:
                 instance = self.update_in_db(dic, qs)
                 self.res = GenerationStatus.Updated
+                if self.related_cache is not None:
+                    self.related_cache.invalidate(instance)
             else:
                 self.res = GenerationStatus.Exists
                 instance = qs[0]
@@ -170,14 +795,213 @@ class BaseGenerator(object):
                 instance = self.create_in_db(dic)
                 self.res = GenerationStatus.Created
         if back_refs and instance:
-            for field, data in back_refs.items():
-                if not isinstance(data, list):
-                    data = [data]
-                for datum in data:
-                    datum[field.field.name] = instance
-                    self.__class__(field.related_model).get_instance(datum)
+            self.create_back_refs(instance, back_refs)
         return instance
 
+    def prepare_row(self, dic):
+        """
+        Prepares a single record of a batch. Invalid records are marked
+        by an exception as result. Related records created for them are
+        rolled back with a savepoint, like a record written on its own.
+        """
+        row = BatchRow(dic.pop('etl_persistence', self.persistence),
+                       dic.pop('etl_create', self.create),
+                       dic.pop('etl_update', self.update))
+        self.related_instances = {}
+        try:
+            if self.may_write_related(dic):
+                marks = self.get_cache_marks()
+                try:
+                    with transaction.atomic():
+                        row.dic, row.back_refs = self.prepare(dic)
+                except (ValidationError, ValueError):
+                    self.rollback(marks)
+                    raise
+            else:
+                row.dic, row.back_refs = self.prepare(dic)
+        except (ValidationError, ValueError) as exc:
+            row.res = exc
+        row.related_instances = self.related_instances
+        return row
+
+    def query_row(self, row):
+        """
+        Runs the persistence query of a prepared row, answered from the
+        persistence index where possible.
+        """
+        try:
+            dic, row.qs, row.update = self.get_persistence_query(
+                row.dic, row.persistence, row.update)
+        except (ValidationError, ValueError) as exc:
+            row.res = exc
+            return
+        row.dic = {item: dic[item] for item in dic if item in self.field_names}
+
+    def build_persistence_index(self, rows):
+        """
+        Returns a PersistenceIndex holding the existing records for
+        a batch of prepared rows.
+        """
+        index = PersistenceIndex(self)
+        index.load(
+            (row.dic, self.get_persistence_lookups(row.persistence))
+            for row in rows)
+        return index
+
+    def resolve_rows(self, rows):
+        """
+        Decides between creation and update for a batch of prepared rows.
+        Rows sharing persistence keys within the batch are merged into
+        the same instance. Returns the instances to create and a
+        dictionary of instances to update with their changed fields.
+        """
+        pending = {}
+        creates = []
+        updates = OrderedDict()
+        for row in rows:
+            keys = self.get_persistence_keys(row.dic, row.persistence) or []
+            instance = next(
+                (pending[key] for key in keys if key in pending), None)
+            if instance is None and row.qs:
+                instance = row.qs[0]
+            if instance is not None:
+                if row.update:
+                    for name, value in iteritems(row.dic):
+                        setattr(instance, name, value)
+                    if instance.pk is not None:
+                        _, fields = updates.setdefault(
+                            id(instance), (instance, set()))
+                        fields.update(row.dic)
+                    row.res = GenerationStatus.Updated
+                else:
+                    row.res = GenerationStatus.Exists
+            elif row.create:
+                instance = self.model_class(**row.dic)
+                creates.append(instance)
+                row.res = GenerationStatus.Created
+            row.instance = instance
+            if instance is not None:
+                for key in keys:
+                    pending.setdefault(key, instance)
+        return creates, updates
+
+    def write_rows(self, rows, creates, updates):
+        """
+        Writes the instances resolved by resolve_rows. Instances which
+        need a primary key for relationships are saved one by one if
+        the backend does not return keys from bulk inserts.
+
+        In upsert mode, see get_upsert_fields, new and changed records
+        are written in a single INSERT ... ON CONFLICT statement. Whether
+        a row counts as created or updated is still decided by the
+        persistence index, a record inserted concurrently in the meantime
+        is updated instead of raising an IntegrityError.
+        """
+        unique_fields = self.get_upsert_fields(rows)
+        if self.model_class._meta.parents:
+            for instance in creates:
+                instance.save(force_insert=True)
+            creates = []
+        elif creates and not self.can_bulk_create(bool(unique_fields)):
+            related = set(id(row.instance) for row in rows
+                          if row.back_refs or row.related_instances)
+            for instance in creates:
+                if id(instance) in related:
+                    instance.save(force_insert=True)
+            creates = [
+                instance for instance in creates if instance.pk is None]
+        pk_name = self.model_class._meta.pk.name
+        fields = set()
+        for _, changed in updates.values():
+            fields.update(changed)
+        fields.discard(pk_name)
+        if unique_fields:
+            for instance in creates:
+                fields.update(
+                    field.name for field in self.model_class._meta.fields)
+            fields.discard(pk_name)
+            fields.difference_update(unique_fields)
+            instances = creates + [
+                self.copy_instance(instance)
+                for instance, _ in updates.values()]
+            if instances:
+                self.upsert_in_db(instances, unique_fields, sorted(fields))
+                self.fetch_pks(
+                    [instance for instance in creates if instance.pk is None],
+                    unique_fields)
+        else:
+            if creates:
+                self.bulk_create_in_db(creates)
+            if fields:
+                self.bulk_update_in_db(
+                    [instance for instance, _ in updates.values()],
+                    sorted(fields))
+        if updates and self.related_cache is not None:
+            for instance, _ in updates.values():
+                self.related_cache.invalidate(instance)
+
+    def copy_instance(self, instance):
+        """
+        Returns an unsaved copy of instance without primary key, used to
+        write existing records with upsert_in_db.
+        """
+        return self.model_class(**dict(
+            (field.attname, getattr(instance, field.attname))
+            for field in self.model_class._meta.concrete_fields
+            if not field.primary_key))
+
+    def get_instances(self, dics):
+        """
+        Batch version of get_instance for a list of dictionaries.
+        Existing records are fetched for the whole batch into a
+        PersistenceIndex, create-or-update is resolved in memory and the
+        records are written with bulk_create and bulk_update. Run it within a
+        transaction, the Loader uses one transaction per batch.
+
+        Overrides of create_in_db and update_in_db are not used here,
+        override bulk_create_in_db and bulk_update_in_db instead.
+
+        Args:
+            dics(list): Data dictionaries.
+
+        Returns:
+            list: One (instance, result) tuple per dictionary. The result
+            is a GenerationStatus or the exception rejecting the record.
+        """
+        rows = self.prepare_rows(dics)
+        self.load_rows([row for row in rows if row.res is None])
+        return [(row.instance, row.res) for row in rows]
+
+    def prepare_rows(self, dics):
+        return [self.prepare_row(dic.copy()) for dic in dics]
+
+    def load_rows(self, rows):
+        """
+        Writes a batch of prepared rows, see get_instances.
+        """
+        self.persistence_index = self.build_persistence_index(rows)
+        try:
+            for row in rows:
+                self.query_row(row)
+        finally:
+            self.persistence_index = None
+        rows = [row for row in rows if row.res is None]
+        creates, updates = self.resolve_rows(rows)
+        self.write_rows(rows, creates, updates)
+        self.relate_rows(rows)
+
+    def relate_rows(self, rows):
+        """
+        Creates the reverse relationships and many-to-many links of
+        a batch of written rows.
+        """
+        rows = [row for row in rows if row.instance is not None]
+        self.create_back_refs_batch(
+            (row.instance, row.back_refs) for row in rows)
+        self.related_instances = {}
+        self.assign_related_batch(
+            (row.instance, row.related_instances) for row in rows)
+
     def instance_from_int(self, intnumber):
         query = {self.related_field or 'pk': intnumber}
         try:
@@ -193,20 +1017,110 @@ class BaseGenerator(object):
             return self.instance_from_dic(dic)
 
     def assign_related(self, instance):
+        """
+        Links the related instances of a single record with the related
+        managers, which send m2m_changed signals. Batches are linked by
+        assign_related_batch without signals.
+        """
+        if instance is None:
+            return
         for (key, lst) in iteritems(self.related_instances):
+            lst = [item for item in lst if item is not None]
             field = getattr(instance, key)
             try:
+                if self.remove_related:
+                    field.remove(*[
+                        item for item in field.all() if item not in lst])
                 field.add(*lst)
             except AttributeError:
-                generator = InstanceGenerator(field.through)
-                for item in lst:
-                    instance = generator.get_instance({
-                        field.source_field_name: instance.pk,
-                        field.target_field_name: item.pk,
-                        'etl_persistence': [
-                            field.source_field_name,
-                            field.target_field_name
-                        ]})
+                # no add and remove for custom through models before
+                # Django 2.2
+                self.update_links(
+                    key, [(instance, lst)], remove=self.remove_related)
+
+    def get_through_fields(self, name):
+        """
+        Returns the through model of the many-to-many relation name and
+        the foreign keys on it pointing to this and to the related model.
+        Works for both sides of the relation.
+        """
+        field = self.model_class._meta.get_field(name)
+        if isinstance(field, ManyToManyRel):
+            through = field.through
+            source = field.field.m2m_reverse_field_name()
+            target = field.field.m2m_field_name()
+        else:
+            through = field.remote_field.through
+            source = field.m2m_field_name()
+            target = field.m2m_reverse_field_name()
+        return (through, through._meta.get_field(source),
+                through._meta.get_field(target))
+
+    def update_links(self, name, items, remove=False):
+        """
+        Brings the links of the many-to-many relation name up to date.
+        The currently linked records of all instances are fetched with
+        one query per chunk of instances and compared with the incoming
+        ones, only missing links are inserted with bulk_create. Unlike
+        field.add, this does not send m2m_changed signals.
+
+        Args:
+            name(str): Name of the many-to-many field.
+            items(list): (instance, related instances) tuples.
+            remove(bool): Also delete links of the instances to records
+                not in their list.
+        """
+        through, source, target = self.get_through_fields(name)
+        pairs = OrderedDict()
+        sources = set()
+        for instance, lst in items:
+            source_value = getattr(instance, source.target_field.attname)
+            sources.add(source_value)
+            for item in lst:
+                if item is not None:
+                    pairs[(source_value,
+                           getattr(item, target.target_field.attname))] = None
+        sources = list(sources)
+        stale = []
+        chunk_size = PersistenceIndex.chunk_size
+        for start in range(0, len(sources), chunk_size):
+            for pk, source_value, target_value in through.objects.filter(**{
+                    source.attname + '__in':
+                        sources[start:start + chunk_size]}).values_list(
+                            'pk', source.attname, target.attname):
+                try:
+                    del pairs[(source_value, target_value)]
+                except KeyError:
+                    stale.append(pk)
+        if remove:
+            for start in range(0, len(stale), chunk_size):
+                through.objects.filter(
+                    pk__in=stale[start:start + chunk_size]).delete()
+        if not pairs:
+            return
+        kwargs = {}
+        features = connections[router.db_for_write(through)].features
+        if getattr(features, 'supports_ignore_conflicts', False):
+            kwargs['ignore_conflicts'] = True
+        through.objects.bulk_create([
+            through(**{source.attname: pair[0], target.attname: pair[1]})
+            for pair in pairs], **kwargs)
+
+    def assign_related_batch(self, items):
+        """
+        Batch version of assign_related, collects the related instances
+        of all instances per many-to-many field and writes them with
+        update_links.
+
+        Args:
+            items: Iterable of (instance, related_instances) tuples.
+        """
+        links = OrderedDict()
+        for instance, related_instances in items:
+            for name, lst in iteritems(related_instances):
+                links.setdefault(name, []).append((instance, lst))
+        for name, lst in iteritems(links):
+            self.update_links(name, lst, remove=self.remove_related)
 
     def get_instance(self, obj):
         """
@@ -214,8 +1128,14 @@ class BaseGenerator(object):
         """
         if isinstance(obj, dict):
             dic = obj.copy()
-            instance = self.instance_from_dic(dic)
-            self.assign_related(instance)
+            # generators are shared, keep the state of an outer call
+            related_instances = self.related_instances
+            self.related_instances = {}
+            try:
+                instance = self.instance_from_dic(dic)
+                self.assign_related(instance)
+            finally:
+                self.related_instances = related_instances
             return instance
         if isinstance(obj, self.model_class):
             self.res = GenerationStatus.Exists
@@ -229,6 +1149,61 @@ class BaseGenerator(object):
     def prepare(self, dic):
         return dic, {}
 
+    def get_caches(self):
+        """
+        Returns the caches of this generator which need to follow
+        commits and rollbacks, see commit.
+        """
+        return []
+
+    def get_transaction_caches(self):
+        caches = []
+        if self.related_cache is not None:
+            caches.append(self.related_cache)
+        generators = [self] + list(self.generators.values())
+        for generator in generators:
+            for cache in generator.get_caches():
+                if not any(cache is other for other in caches):
+                    caches.append(cache)
+        return caches
+
+    def commit(self):
+        """
+        Called by the Loader once the records written since the last
+        call of commit or rollback were committed.
+        """
+        for cache in self.get_transaction_caches():
+            cache.commit()
+
+    def rollback(self, marks=None):
+        """
+        Called by the Loader if the transaction was rolled back. Drops
+        cached records created or changed since the last commit, from
+        this generator and the nested generators. With marks returned
+        by get_cache_marks, only those changed since then are dropped.
+        """
+        if marks is None:
+            for cache in self.get_transaction_caches():
+                cache.rollback()
+        else:
+            for cache, mark in marks:
+                cache.rollback(mark)
+
+    def get_cache_marks(self):
+        """
+        Returns the current journal positions of the caches, for rolling
+        back to a savepoint with rollback.
+        """
+        return [(cache, len(cache.journal))
+                for cache in self.get_transaction_caches()]
+
+    def may_write_related(self, dic):
+        """
+        True if preparing dic may write related records, in which case
+        prepare_row runs it in a savepoint.
+        """
+        return True
+
     def finalize(self):
         """
         Override this method to finalize your data generation job,
@@ -262,6 +1237,67 @@ class InstanceGenerator(BaseGenerator):
         'BigIntegerField': 'prepare_integer',
         'FloatField': 'prepare_float',
         'JSONField': 'prepare_text'}
+    # coercions applied to whole columns of a batch by prepare_columns
+    column_preparations = {
+        'prepare_text': 'coerce_texts',
+        'prepare_boolean': 'coerce_booleans',
+        'prepare_integer': 'coerce_integers',
+        'prepare_float': 'coerce_floats'}
+    field_plans = {}
+
+    def __init__(self, model_class, persistence=None, options=None):
+        super(InstanceGenerator, self).__init__(
+            model_class, persistence=persistence, options=options)
+        options = options or {}
+        self.reject_invalid = options.get('reject_invalid', False)
+        self.coerced = {}
+        self.date_formfields = {}
+        self.date_formats = {}
+        self.wkb_writer = None
+        self.field_plan = {}
+        self.column_plan = OrderedDict()
+        self.related_names = set()
+        for name, field, method, null in self.get_field_plan(
+                self.model_class):
+            self.field_plan[name] = (
+                field, method and getattr(self, method), null)
+            if method is not None and getattr(field, 'is_relation', False):
+                self.related_names.add(name)
+            column_method = self.column_preparations.get(method)
+            # subclasses overriding a per-value preparation keep it
+            if column_method and getattr(type(self), method) is getattr(
+                    InstanceGenerator, method, None):
+                self.column_plan[name] = (field, getattr(self, column_method))
+
+    @classmethod
+    def get_field_plan(cls, model_class):
+        """
+        Returns the preparation plan for model_class as a tuple of
+        (field name, field, preparation method name, nullable) tuples.
+        Back references have None as method name. The plan is compiled
+        once per generator class and model.
+        """
+        key = (cls, model_class)
+        try:
+            return cls.field_plans[key]
+        except KeyError:
+            pass
+        plan = []
+        for field in get_fields(model_class):
+            if isinstance(field, ManyToOneRel):
+                plan.append((field.name, field, None, False))
+                continue
+            method = cls.preparations.get(
+                get_internal_type(field), 'prepare_field')
+            if not hasattr(cls, method):
+                method = 'prepare_field'
+            plan.append(
+                (field.name, field, method, getattr(field, 'null', False)))
+        cls.field_plans[key] = tuple(plan)
+        return cls.field_plans[key]
+
+    def may_write_related(self, dic):
+        return any(name in self.related_names for name in dic)
 
     def prepare_none(self, field, value):
         return None
@@ -269,32 +1305,94 @@ class InstanceGenerator(BaseGenerator):
     def prepare_field(self, field, value):
         return value
 
+    def get_related_instance(self, model_class, value, options=None):
+        """
+        Resolves a related instance with a nested generator. Results are
+        kept in the related cache if the generator has one.
+        """
+        cache = self.related_cache
+        key = None
+        if cache is not None:
+            key = cache.make_key(model_class, options, value)
+            if key is not None:
+                instance = cache.get(key)
+                if instance is not None:
+                    return instance
+        instance = self.get_generator(
+            model_class, options).get_instance(value)
+        if key is not None and instance is not None:
+            cache.set(key, instance)
+        return instance
+
     def prepare_fk(self, field, value):
         try:
             options = {'related_field': field.related_fields[0][1].name}
         except AttributeError:
             options = {'related_field': field.related_name}
         related = getattr(field, 'related_model')
-        return self.__class__(related, options=options).get_instance(value)
+        return self.get_related_instance(related, value, options)
 
     def prepare_m2m(self, field, lst):
         """
         Defers assignment of related instances until instance creation is
         finished.
         """
-        self.related_instances[field.name] = []
         if not isinstance(lst, list):
             lst = [lst]
-        for item in lst:
-            related = getattr(field, 'related_model')
-            generator = self.__class__(related)
-            instance = generator.get_instance(item)
-            self.related_instances[field.name].append(instance)
+        related = getattr(field, 'related_model')
+        self.related_instances[field.name] = [
+            self.get_related_instance(related, item) for item in lst]
+
+    def get_date_formfield(self, field):
+        formfield = self.date_formfields.get(field.name)
+        if formfield is None:
+            formfield = DateTimeField(required=not field.null)
+            self.date_formfields[field.name] = formfield
+        return formfield
+
+    def parse_date(self, field, value):
+        """
+        Parses a datetime string with datetime.fromisoformat, where
+        available (Python 3.7 and later), or the input formats of the
+        form field. The format which worked is tried first for the next
+        value of the same field. Returns None if no format matches.
+        """
+        last = self.date_formats.get(field.name)
+        if last is not None:
+            try:
+                if last is ISO_FORMAT:
+                    return datetime.fromisoformat(value)
+                return datetime.strptime(value, last)
+            except ValueError:
+                pass
+        formats = list(self.get_date_formfield(field).input_formats)
+        if hasattr(datetime, 'fromisoformat'):
+            formats.insert(0, ISO_FORMAT)
+        for date_format in formats:
+            if date_format == last:
+                continue
+            try:
+                if date_format is ISO_FORMAT:
+                    res = datetime.fromisoformat(value)
+                else:
+                    res = datetime.strptime(value, date_format)
+            except (ValueError, TypeError):
+                continue
+            self.date_formats[field.name] = date_format
+            return res
+        return None
 
     def prepare_date(self, field, value):
         if not (field.auto_now or field.auto_now_add):
-            formfield = DateTimeField(required=not field.null)
-            return formfield.clean(value)
+            if isinstance(value, text_type) and value.strip():
+                res = self.parse_date(field, value.strip())
+                if res is not None:
+                    if not settings.USE_TZ and timezone.is_aware(res):
+                        # e.g. ISO 8601 offsets, to local time
+                        return timezone.make_naive(res)
+                    return from_current_timezone(res)
+            # empty values, other types, and errors
+            return self.get_date_formfield(field).clean(value)
 
     def prepare_text(self, field, value):
         if value is None:
@@ -325,40 +1423,146 @@ class InstanceGenerator(BaseGenerator):
         except (ValueError, TypeError):
             pass
 
+    def coerce_texts(self, field, values):
+        """
+        Column version of prepare_text. Like the other coerce methods it
+        returns the coerced values and the positions of values which
+        could not be coerced.
+        """
+        length = getattr(field, 'max_length', None)
+        return [
+            None if value is None else (
+                value if isinstance(value, (text_type, binary_type))
+                else text(value))[0:length]
+            for value in values], []
+
+    def coerce_booleans(self, field, values):
+        return [bool(value) and value in [1, '1', 'True', 'true', 't']
+                for value in values], []
+
+    def coerce_numbers(self, values, number_type, dtype, kinds):
+        """
+        Coerces values with number_type, the NumPy parser for dtype is
+        used if available and all values are of the given dtype kinds.
+        Columns with a single invalid value fall back to Python.
+        """
+        if numpy is not None and len(values) > 1:
+            try:
+                array = numpy.array(values)
+            except (ValueError, TypeError):
+                array = None
+            if array is not None and array.dtype.kind in kinds:
+                try:
+                    return array.astype(dtype).tolist(), []
+                except (ValueError, TypeError, OverflowError):
+                    pass
+        res = []
+        invalid = []
+        for index, value in enumerate(values):
+            try:
+                res.append(number_type(value))
+            except (ValueError, TypeError):
+                res.append(None)
+                if value not in (None, ''):
+                    invalid.append(index)
+        return res, invalid
+
+    def coerce_integers(self, field, values):
+        return self.coerce_numbers(
+            values, int, numpy and numpy.int64, 'Ui')
+
+    def coerce_floats(self, field, values):
+        return self.coerce_numbers(
+            values, float, numpy and numpy.float64, 'Uif')
+
+    def prepare_columns(self, dics):
+        """
+        Applies the text, boolean, integer, and float preparations to
+        whole columns of a batch.
+
+        Returns:
+            tuple: A dictionary of coerced values per record and a
+            ValidationError per record naming the fields with invalid
+            values, None for valid records. Like the per-value
+            preparations, invalid values are coerced to None.
+        """
+        coerced = [{} for _ in dics]
+        invalid = [{} for _ in dics]
+        for name, (field, coerce) in iteritems(self.column_plan):
+            rows = [index for index, dic in enumerate(dics) if name in dic]
+            if not rows:
+                continue
+            values, errors = coerce(field, [dics[row][name] for row in rows])
+            for row, value in zip(rows, values):
+                coerced[row][name] = value
+            for position in errors:
+                invalid[rows[position]][name] = 'Invalid value {}'.format(
+                    dics[rows[position]][name])
+        return coerced, [ValidationError(item) if item else None
+                         for item in invalid]
+
+    def prepare_rows(self, dics):
+        """
+        Prepares a batch with the column coercions of prepare_columns.
+        Records with invalid values are rejected if the option
+        reject_invalid is set.
+        """
+        coerced, errors = self.prepare_columns(dics)
+        rows = []
+        for dic, values, error in zip(dics, coerced, errors):
+            self.coerced = values
+            try:
+                row = self.prepare_row(dic.copy())
+            finally:
+                self.coerced = {}
+            if error is not None and self.reject_invalid and row.res is None:
+                row.res = error
+            rows.append(row)
+        return rows
+
     def prepare_geometry(self, field, value):
         """
         Reduce geometry to two dimensions if GeometryField's
-        dim parameter is not set otherwise.
-        """
-        from django.contrib.gis.geos import WKBWriter, GEOSGeometry
-        if isinstance(value, (str, text_type)):
-            value = GEOSGeometry(value)
-        wkb_writer = WKBWriter()
-        if isinstance(value, GEOSGeometry):
-            if value.hasz and field.dim == 2:
-                value = GEOSGeometry(wkb_writer.write(value))
+        dim parameter is not set otherwise. Accepts geometries, strings
+        GEOSGeometry can read, and WKB as bytes, bytearray, or
+        memoryview.
+        """
+        geos = get_geos()
+        if isinstance(value, (bytes, bytearray)):
+            value = memoryview(value)
+        if isinstance(value, (str, text_type, memoryview)):
+            value = geos.GEOSGeometry(value)
+        if isinstance(value, geos.GEOSGeometry):
+            if field.dim == 2 and value.hasz:
+                if self.wkb_writer is None:
+                    # writes two dimensions by default
+                    self.wkb_writer = geos.WKBWriter()
+                value = geos.GEOSGeometry(
+                    self.wkb_writer.write(value), srid=value.srid)
         return value
 
     def prepare(self, dic):
         ret = {}
         back_refs = {}
-        for field in get_fields(self.model_class):
-            if field.name not in dic:
+        plan = self.field_plan
+        coerced = self.coerced
+        for name in [name for name in dic if name in plan]:
+            field, prepare_function, null = plan[name]
+            if prepare_function is None:
+                back_refs[field] = dic.pop(name)
                 continue
-            if isinstance(field, ManyToOneRel):
-                back_refs[field] = dic.pop(field.name)
-                continue
-            fieldtype = get_internal_type(field)
-            prepare_function = getattr(self, self.preparations[fieldtype],
-                                       self.prepare_field)
-            try:
-                res = prepare_function(field, dic.pop(field.name))
-            except ValidationError as e:
-                raise ValidationError({field.name:str(e.message)})
+            if name in coerced:
+                dic.pop(name)
+                res = coerced[name]
+            else:
+                try:
+                    res = prepare_function(field, dic.pop(name))
+                except ValidationError as e:
+                    raise ValidationError({name:str(e.message)})
             if res is not None:
-                if not res and getattr(field, 'null', False):
+                if not res and null:
                     res = None
-                ret[field.name] = res
+                ret[name] = res
         return ret, back_refs
 
 
@@ -366,26 +1570,138 @@ class HashMixin(object):
     """
     Mix-in adding hashing to Generators. Replaces persistence
     criterion.
+
+    With the option hash_index the hashes of all existing records are
+    loaded into a HashIndex on first use. Unchanged records are then
+    recognized without searching the hash field, they are fetched by
+    primary key, in get_instances with one query per batch.
     """
     hashfield = 'md5'
     do_not_hash_fields = ['id', 'last_modified']
+    # 'legacy' is the md5 of the concatenated values used by earlier
+    # versions, 'blake2b' or any hashlib algorithm hash length-prefixed
+    # field names and values. Changing it updates every record once.
+    hash_algorithm = 'legacy'
+    hash_digest_size = 16
+
+    def __init__(self, model_class, persistence=None, options=None):
+        super(HashMixin, self).__init__(
+            model_class, persistence=persistence, options=options)
+        self.hash_fields = {}
+        self.preload_hashes = bool(
+            (options or {}).get('hash_index') and
+            self.hashfield in self.field_names)
+        self.hash_index = None
+        self.hashed_instances = None
+
+    def prepare(self, dic):
+        dic, back_refs = super(HashMixin, self).prepare(dic)
+        return self.hash_dic(dic), back_refs
+
+    def get_persistence_lookups(self, persistence):
+        return [self.hashfield] + super(
+            HashMixin, self).get_persistence_lookups(persistence)
+
+    def get_hashed_pk(self, dic):
+        """
+        Returns the primary key of the record with the hash of dic from
+        the hash index, None if there is none or the index is disabled.
+        """
+        if not self.preload_hashes:
+            return None
+        if self.hash_index is None:
+            self.hash_index = HashIndex(self.model_class, self.hashfield)
+            self.hash_index.load()
+        return self.hash_index.get(dic.get(self.hashfield))
+
+    def get_caches(self):
+        caches = super(HashMixin, self).get_caches()
+        if self.hash_index is not None:
+            caches.append(self.hash_index)
+        return caches
+
+    def get_hashed_instance(self, pk):
+        """
+        Returns the record with primary key pk, None if it was deleted
+        since the hash index was loaded.
+        """
+        if self.hashed_instances is not None:
+            return self.hashed_instances.get(pk)
+        return self.model_class.objects.filter(pk=pk).first()
+
+    def index_hash(self, instance, res):
+        if (self.hash_index is not None and instance is not None and
+                res in (GenerationStatus.Created, GenerationStatus.Updated)):
+            self.hash_index.add(
+                getattr(instance, self.hashfield), instance.pk)
+
+    def instance_from_dic(self, dic):
+        instance = super(HashMixin, self).instance_from_dic(dic)
+        self.index_hash(instance, self.res)
+        return instance
+
+    def build_persistence_index(self, rows):
+        pks = [self.get_hashed_pk(row.dic) for row in rows]
+        self.hashed_instances = self.model_class.objects.in_bulk(
+            [pk for pk in pks if pk is not None])
+        return super(HashMixin, self).build_persistence_index(
+            [row for row, pk in zip(rows, pks)
+             if pk not in self.hashed_instances])
+
+    def load_rows(self, rows):
+        try:
+            super(HashMixin, self).load_rows(rows)
+        finally:
+            self.hashed_instances = None
+        for row in rows:
+            self.index_hash(row.instance, row.res)
 
     def get_persistence_query(self, dic, persistence, update):
-        dic = self.hash_dic(dic)
+        if self.hashfield not in dic:
+            dic = self.hash_dic(dic)
+        pk = self.get_hashed_pk(dic)
+        instance = self.get_hashed_instance(pk) if pk is not None else None
+        if instance is not None:
+            return dic, [instance], False
         items = self.get_from_db(dic, [self.hashfield])
         if len(items) > 0:
             return dic, items, False
         return dic, self.get_from_db(dic, persistence), update
 
+    def get_hash_fields(self, dic):
+        """
+        Returns the sorted fields of dic to hash, cached per set of keys.
+        """
+        key = tuple(dic)
+        fields = self.hash_fields.get(key)
+        if fields is None:
+            excluded = set([self.hashfield] + list(self.do_not_hash_fields))
+            fields = sorted(field for field in dic if field not in excluded)
+            self.hash_fields[key] = fields
+        return fields
+
+    def get_hasher(self):
+        if self.hash_algorithm == 'blake2b':
+            return hashlib.blake2b(digest_size=self.hash_digest_size)
+        return hashlib.new(self.hash_algorithm)
+
     def hash(self, dic):
-        text_representation = ''
-        fields = sorted([
-            field for field in dic
-            if field not in [self.hashfield] +
-            list(self.do_not_hash_fields)])
+        fields = self.get_hash_fields(dic)
+        if self.hash_algorithm == 'legacy':
+            return hashlib.md5(''.join(
+                [text(dic[field]) for field in fields]).encode(
+                    'utf-8')).hexdigest()
+        hasher = self.get_hasher()
+        pack = LENGTH.pack
         for field in fields:
-            text_representation += text(dic[field])
-        return md5(text_representation.encode('utf-8')).hexdigest()
+            for value in (field, dic[field]):
+                if value is None:
+                    hasher.update(pack(-1))
+                    continue
+                data = text(value).encode('utf-8')
+                hasher.update(pack(len(data)))
+                hasher.update(data)
+        return hasher.hexdigest()
 
     def hash_dic(self, dic):
         dic[self.hashfield] = self.hash(dic)
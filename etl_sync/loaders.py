@@ -1,16 +1,140 @@
 from __future__ import absolute_import, print_function
 
+import bz2
+import gzip
 import io
+import json
+import lzma
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import threading
+from array import array
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Full, Queue
 
 from backports import csv
 from django.core.exceptions import ValidationError
-from django.db import DatabaseError, IntegrityError, transaction
+from django.db import (
+    DatabaseError, IntegrityError, connections, router, transaction)
+from django.db.models import Max
+from six import text_type
 
-from .generators import InstanceGenerator
-from .logging import StdoutLogger
+from .generators import InstanceGenerator, RelatedCache, get_fields
+from .logging import StdoutLogger, WorkerLogger
 from .transformations import Transformer
 from .types import CaseInsensitiveDict
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class OffsetIndex(object):
+    """
+    Sidecar index of the byte offsets at which the records of a CSV file
+    start. It is built in a single pass over the raw bytes that only
+    looks at line breaks and, unless quoting is QUOTE_NONE, quote
+    characters. Blank lines are skipped like csv.DictReader does. Line
+    breaks consisting of a single carriage return and escape characters
+    are not supported. The index is stored next to the source and
+    rebuilt whenever size or modification time of the source change.
+
+    Args:
+        source (str): Path of the CSV file.
+        path (str): Path of the index file, defaults to source + '.idx'.
+        header (bool): Whether the first record holds the field names.
+        quotechar (str): Quote character of the CSV dialect.
+        quoting (int): Quoting mode of the CSV dialect.
+    """
+    chunk_size = 1 << 20
+
+    def __init__(self, source, path=None, header=True, quotechar='"',
+                 quoting=csv.QUOTE_MINIMAL):
+        self.source = source
+        self.path = path or '{}.idx'.format(source)
+        self.header = header
+        self.quotechar = quotechar
+        self.quoting = quoting
+        self.offsets = None
+
+    def __len__(self):
+        return len(self.load())
+
+    def __getitem__(self, row):
+        """
+        Returns the offset of record row, counting from 1.
+        """
+        return self.load()[row - 1]
+
+    def get_stamp(self):
+        stat = os.stat(self.source)
+        return array('Q', [stat.st_size, int(stat.st_mtime * 1e6)])
+
+    def load(self):
+        """
+        Returns the offsets, read from the index file if it is up to
+        date, otherwise built and written.
+        """
+        if self.offsets is not None:
+            return self.offsets
+        stamp = self.get_stamp()
+        try:
+            with io.open(self.path, 'rb') as fil:
+                offsets = array('Q')
+                offsets.frombytes(fil.read())
+            if offsets[0:2] == stamp:
+                self.offsets = offsets[2:]
+                return self.offsets
+        except (IOError, OSError, ValueError):
+            pass
+        self.offsets = self.build()
+        try:
+            with io.open(self.path, 'wb') as fil:
+                fil.write((stamp + self.offsets).tobytes())
+        except (IOError, OSError):
+            pass
+        return self.offsets
+
+    def build(self):
+        offsets = array('Q')
+        if self.quoting == csv.QUOTE_NONE:
+            pattern = re.compile(b'\n')
+        else:
+            pattern = re.compile(
+                b'[\n' + re.escape(self.quotechar.encode('ascii')) + b']')
+        in_quotes = False
+        start = 0
+        pos = 0
+        last = b''
+        with io.open(self.source, 'rb') as fil:
+            while True:
+                chunk = fil.read(self.chunk_size)
+                if not chunk:
+                    break
+                for match in pattern.finditer(chunk):
+                    if match.group() != b'\n':
+                        in_quotes = not in_quotes
+                        continue
+                    if in_quotes:
+                        continue
+                    end = pos + match.start()
+                    before = chunk[match.start() - 1:match.start()] or last
+                    if end > start and not (
+                            end == start + 1 and before == b'\r'):
+                        offsets.append(start)
+                    start = end + 1
+                pos += len(chunk)
+                last = chunk[-1:]
+        if pos > start and not (pos == start + 1 and last == b'\r'):
+            offsets.append(start)
+        return offsets[1:] if self.header else offsets
+
 
 class Extractor(object):
     """
@@ -25,8 +149,36 @@ class Extractor(object):
         options (dic): custom options that need to be passed through to
             reader
 
+    Files compressed with gzip, bzip2, xz or zstd (with the zstandard
+    package or the zstd command) are decompressed while reading. The
+    compression is detected by the magic bytes of regular files and by
+    the extension of other paths, e.g. named pipes. Records of
+    compressed files can not be seeked to, offset_index and slice_offset
+    are ignored.
+
+    Options:
+        compression (str or bool): One of 'gzip', 'bz2', 'xz' or 'zstd'
+            to skip the detection, False to read the file as is.
+        decompress_threads (bool): Decompress in a separate process with
+            a multithreaded command if one is installed, e.g. pigz or
+            xz -T0.
+
     Return reader instance.
     """
+    buffer_size = 1 << 20
+    magic_bytes = [
+        (b'\x1f\x8b', 'gzip'),
+        (b'BZh', 'bz2'),
+        (b'\xfd7zXZ\x00', 'xz'),
+        (b'\x28\xb5\x2f\xfd', 'zstd'),
+    ]
+    extensions = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.zst': 'zstd'}
+    decompress_commands = {
+        'gzip': [['pigz', '-dc']],
+        'bz2': [['lbzip2', '-dc'], ['pbzip2', '-dc']],
+        'xz': [['xz', '-dc', '-T0']],
+        'zstd': [['zstd', '-dc', '-T0']],
+    }
 
     def __init__(self, source, reader_class=None,
                  reader_kwargs=None, options=None):
@@ -38,6 +190,118 @@ class Extractor(object):
             'quoting': csv.QUOTE_NONE
         }
         self.fil = None
+        self.skipped = 0
+        self.offset_index = None
+        self.compression = None
+        self.process = None
+
+    def get_compression(self):
+        """
+        Returns the compression of the source, None if it is not a
+        compressed file.
+        """
+        if self.compression is not None:
+            return self.compression or None
+        compression = self.options.get('compression')
+        if compression is None and isinstance(self.source, str):
+            if os.path.isfile(self.source):
+                with io.open(self.source, 'rb') as fil:
+                    start = fil.read(6)
+                for magic, name in self.magic_bytes:
+                    if start.startswith(magic):
+                        compression = name
+                        break
+            elif os.path.exists(self.source):
+                compression = self.extensions.get(
+                    os.path.splitext(self.source)[1].lower())
+        self.compression = compression or False
+        return compression or None
+
+    def can_seek(self):
+        """
+        Whether records can be seeked to by their byte offsets.
+        """
+        return (not hasattr(self.source, 'read') and
+                not self.get_compression())
+
+    def get_decompress_command(self, compression):
+        for command in self.decompress_commands[compression]:
+            if shutil.which(command[0]):
+                return command
+        return None
+
+    def open_compressed(self, compression):
+        """
+        Returns a text stream of the decompressed source.
+        """
+        command = None
+        if (self.options.get('decompress_threads') or
+                compression == 'zstd' and zstandard is None):
+            command = self.get_decompress_command(compression)
+        if command:
+            self.process = subprocess.Popen(
+                command + [self.source], stdout=subprocess.PIPE, bufsize=0)
+            stream = self.process.stdout
+        elif compression == 'gzip':
+            stream = gzip.open(self.source, 'rb')
+        elif compression == 'bz2':
+            stream = bz2.open(self.source, 'rb')
+        elif compression == 'xz':
+            stream = lzma.open(self.source, 'rb')
+        elif zstandard is not None:
+            stream = zstandard.ZstdDecompressor().stream_reader(
+                io.open(self.source, 'rb'))
+        else:
+            raise ImportError(
+                'Reading {} requires zstandard or the zstd command.'.format(
+                    self.source))
+        return io.TextIOWrapper(io.BufferedReader(stream, self.buffer_size))
+
+    def get_offset_index(self):
+        """
+        Returns the OffsetIndex of the source. The offset_index option
+        is either True or the path of the index file.
+        """
+        if self.offset_index is None:
+            path = self.options.get('offset_index')
+            self.offset_index = OffsetIndex(
+                self.source,
+                path=path if isinstance(path, str) else None,
+                header='fieldnames' not in self.reader_kwargs,
+                quotechar=self.reader_kwargs.get('quotechar', '"'),
+                quoting=self.reader_kwargs.get(
+                    'quoting', csv.QUOTE_MINIMAL))
+        return self.offset_index
+
+    def seek(self, reader):
+        """
+        Moves the file to the record slice_begin if the offset_index
+        option is set, or to the byte offset of that record given in
+        the slice_offset option, so that the preceding records are not
+        parsed. The number of skipped records is kept in self.skipped.
+        """
+        self.skipped = 0
+        begin = self.options.get('slice_begin')
+        offset = self.options.get('slice_offset')
+        if not (begin and begin > 1 and (
+                offset is not None or self.options.get('offset_index'))):
+            return
+        if (self.fil is self.source or not hasattr(self.fil, 'seek') or
+                self.get_compression()):
+            return
+        # make sure the reader has consumed the header
+        getattr(reader, 'fieldnames', None)
+        if offset is not None:
+            self.fil.seek(offset)
+            self.skipped = begin - 1
+            return
+        index = self.get_offset_index()
+        if begin > len(index):
+            self.fil.seek(0, io.SEEK_END)
+            self.skipped = len(index)
+        else:
+            self.fil.seek(index[begin])
+            self.skipped = begin - 1
 
     def __enter__(self):
         """
@@ -51,18 +315,213 @@ class Extractor(object):
         """
         if hasattr(self.source, 'read'):
             self.fil = self.source
+        elif self.get_compression():
+            self.fil = self.open_compressed(self.get_compression())
         else:
             try:
                 self.fil = io.open(self.source)
             except IOError:
                 self.fil = self.source
-        return self.reader_class(self.fil, **self.reader_kwargs)
+        reader = self.reader_class(self.fil, **self.reader_kwargs)
+        self.seek(reader)
+        return reader
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         try:
             self.fil.close()
         except (AttributeError, IOError):
             pass
+        if self.process is not None:
+            process, self.process = self.process, None
+            if process.poll() is None:
+                # stopped early, e.g. at slice_end
+                process.terminate()
+            elif process.wait() and exc_type is None:
+                raise IOError('Decompressing {} failed with status {}.'.format(
+                    self.source, process.returncode))
+            process.wait()
+
+
+class Checkpoint(object):
+    """
+    JSON file holding the position of the next record to load, the byte
+    offset of that record if known, and the counters of a load. It is
+    written after records were committed and ignored if the source
+    changed since.
+
+    Args:
+        path (str): Path of the checkpoint file.
+        source (str): Path of the source, if any.
+    """
+    counters = ['created', 'updated', 'rejected']
+
+    def __init__(self, path, source=None):
+        self.path = path
+        self.source = source
+
+    def get_stamp(self):
+        if not isinstance(self.source, str) or not os.path.isfile(
+                self.source):
+            return None
+        stat = os.stat(self.source)
+        return [stat.st_size, int(stat.st_mtime * 1e6)]
+
+    def load(self):
+        """
+        Returns the saved state, None if there is none or the source
+        changed.
+        """
+        try:
+            with io.open(self.path) as fil:
+                state = json.load(fil)
+        except (IOError, OSError, ValueError):
+            return None
+        if state.get('stamp') != self.get_stamp():
+            return None
+        return state
+
+    def save(self, counter, offset=None):
+        state = {name: getattr(counter, name) for name in self.counters}
+        state.update(pos=counter.pos, offset=offset, stamp=self.get_stamp())
+        temp = '{}.tmp'.format(self.path)
+        with io.open(temp, 'w') as fil:
+            fil.write(text_type(json.dumps(state)))
+        os.replace(temp, self.path)
+
+    def restore(self, state, counter):
+        for name in self.counters:
+            setattr(counter, name, state.get(name, 0))
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class Sweeper(object):
+    """
+    Records the primary keys of the records seen during a load in a
+    temporary table and afterwards deletes the other records of the
+    model, or updates them with the given values for a soft delete.
+    Unseen records are found with NOT EXISTS in the database and
+    removed in chunks of chunk_size. For auto-incremented primary keys,
+    records created after the load started are left alone.
+    """
+    chunk_size = 1000
+    table_prefix = 'etl_seen_'
+
+    def __init__(self, model_class, filters=None, update=None):
+        self.model_class = model_class
+        self.filters = filters or {}
+        self.update = update
+        self.auto = model_class._meta.pk.get_internal_type() in (
+            'AutoField', 'BigAutoField', 'SmallAutoField')
+        self.max_pk = None
+        self.seen = []
+        self.using = router.db_for_write(model_class)
+        self.table = (
+            self.table_prefix + model_class._meta.db_table)[:63]
+
+    def get_connection(self):
+        return connections[self.using]
+
+    def get_queryset(self):
+        return self.model_class.objects.using(self.using).filter(
+            **self.filters)
+
+    def start(self):
+        """
+        Creates the temporary table for the seen keys.
+        """
+        connection = self.get_connection()
+        pk = self.model_class._meta.pk
+        # Django < 1.10 has no rel_db_type
+        db_type = getattr(pk, 'rel_db_type', pk.db_type)(connection)
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DROP TABLE IF EXISTS {}'.format(quote(self.table)))
+            cursor.execute('CREATE TEMPORARY TABLE {} (pk {})'.format(
+                quote(self.table), db_type))
+            cursor.execute('CREATE INDEX {} ON {} (pk)'.format(
+                quote(self.table + '_pk'), quote(self.table)))
+        if self.auto:
+            self.max_pk = self.get_queryset().aggregate(
+                max_pk=Max('pk'))['max_pk']
+
+    def add(self, pk):
+        self.seen.append(pk)
+        if len(self.seen) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered keys to the temporary table.
+        """
+        if not self.seen:
+            return
+        connection = self.get_connection()
+        pk = self.model_class._meta.pk
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO {} (pk) VALUES (%s)'.format(
+                    connection.ops.quote_name(self.table)),
+                [(pk.get_db_prep_value(value, connection),)
+                 for value in self.seen])
+        self.seen = []
+
+    def get_unseen(self, after=None):
+        """
+        Returns the next chunk_size primary keys of records not seen,
+        in primary key order and greater than after if given.
+        """
+        meta = self.model_class._meta
+        quote = self.get_connection().ops.quote_name
+        qs = self.get_queryset()
+        if self.auto:
+            if self.max_pk is None:
+                return []
+            qs = qs.filter(pk__lte=self.max_pk)
+        if after is not None:
+            qs = qs.filter(pk__gt=after)
+        qs = qs.extra(where=[
+            'NOT EXISTS (SELECT 1 FROM {seen} WHERE {seen}.pk = '
+            '{table}.{pk})'.format(
+                seen=quote(self.table), table=quote(meta.db_table),
+                pk=quote(meta.pk.column))])
+        return list(qs.order_by('pk').values_list(
+            'pk', flat=True)[:self.chunk_size])
+
+    def remove(self, pks):
+        qs = self.model_class.objects.using(self.using).filter(pk__in=pks)
+        if self.update:
+            return qs.update(**self.update)
+        return qs.delete()[1].get(self.model_class._meta.label, 0)
+
+    def sweep(self):
+        """
+        Removes the records not seen in chunks, each one in its own
+        transaction. Returns the number of removed records.
+        """
+        self.flush()
+        count = 0
+        unseen = self.get_unseen()
+        while unseen:
+            with transaction.atomic(using=self.using):
+                count += self.remove(unseen)
+            unseen = self.get_unseen(after=unseen[-1])
+        self.close()
+        return count
+
+    def close(self):
+        """
+        Drops the temporary table.
+        """
+        self.seen = []
+        with self.get_connection().cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS {}'.format(
+                self.get_connection().ops.quote_name(self.table)))
 
 
 class Logger(object):
@@ -106,6 +565,39 @@ class Logger(object):
 class Loader(object):
     """
     Generic mapper object for ETL.
+
+    Options (besides those passed on to extractor and generator):
+        slice_begin (int): First row to load.
+        slice_end (int): Last row to load.
+        batch_size (int): Write records in batches of this size, one
+            transaction and one call to the generator's get_instances
+            per batch. By default every record is written in its own
+            transaction.
+        related_cache_size (int): Keep up to this many resolved foreign
+            key instances in a RelatedCache for the whole load.
+        defaults (dict): Defaults passed to the transformer.
+        offset_index (bool or str): Use an OffsetIndex, stored in the
+            given file or next to the source, to seek to slice_begin.
+        sweep (bool): Remove records of the model which were not loaded
+            once the load finished, see Sweeper. Skipped if records were
+            rejected or only a slice is loaded, not supported by
+            ParallelLoader.
+        sweep_filter (dict): Lookups limiting the records to remove.
+        sweep_update (dict): Update unseen records with these values
+            instead of deleting them.
+        checkpoint (bool or str): Save a Checkpoint to the given file,
+            or next to the source, after records were committed. It is
+            removed once the load finished. Not supported by
+            ParallelLoader.
+        checkpoint_interval (int): Save the checkpoint at most every
+            this many records, defaults to 1000.
+        resume (bool): Continue from the saved checkpoint.
+        prune_fields (bool): Pass the source fields used by the model
+            and the transformer mappings to the reader as fields, for
+            readers that skip the others such as OGRReader. Fields only
+            used in custom transformations need to be listed in the
+            reader_kwargs fields. Raises ValueError for readers without
+            an accepts_fields attribute.
     """
     transformer_class = Transformer
     reader_class = csv.DictReader
@@ -114,6 +606,8 @@ class Loader(object):
     model_class = None
     extractor_class = Extractor
     persistence = None
+    # held during write transactions if set, see ParallelLoader
+    write_lock = None
 
     def __init__(self, source, model_class=None, logger=None, options=None):
         self.source = source
@@ -122,53 +616,272 @@ class Loader(object):
         self.model_class = model_class or self.model_class
         self.logger = logger or StdoutLogger()
         self.logger.filename = self.filename
+        self.checkpoint = None
+        self.checkpoint_pos = 1
+        self.resume_state = None
+        if self.options.get('checkpoint'):
+            path = self.options['checkpoint']
+            if not isinstance(path, str):
+                path = '{}.checkpoint'.format(self.filename)
+            self.checkpoint = Checkpoint(path, source=self.source)
+            if self.options.get('resume'):
+                self.resume_state = self.checkpoint.load()
+        if self.resume_state and self.resume_state['pos'] > (
+                self.options.get('slice_begin') or 1):
+            self.options = dict(
+                self.options, slice_begin=self.resume_state['pos'],
+                slice_offset=self.resume_state.get('offset'))
+        reader_kwargs = self.reader_kwargs
+        if self.options.get('prune_fields'):
+            if not getattr(self.reader_class, 'accepts_fields', False):
+                raise ValueError(
+                    'prune_fields is not supported by {}, it does not '
+                    'accept fields.'.format(self.reader_class.__name__))
+            fields = self.get_source_fields()
+            if fields is not None:
+                reader_kwargs = dict(reader_kwargs or {})
+                reader_kwargs['fields'] = sorted(
+                    set(fields) | set(reader_kwargs.get('fields') or []))
         self.extractor = self.extractor_class(self.source, self.reader_class,
-                                              self.reader_kwargs,
+                                              reader_kwargs,
                                               options=self.options)
         self.slice_begin = self.options.get('slice_begin')
         self.slice_end = self.options.get('slice_end')
+        self.batch_size = self.options.get('batch_size')
+        self.related_cache = None
+        generator_options = self.options
+        if self.options.get('related_cache_size'):
+            self.related_cache = RelatedCache(
+                self.options['related_cache_size'])
+            generator_options = dict(
+                self.options, related_cache=self.related_cache)
         self.generator = self.generator_class(self.model_class,
                                               persistence=self.persistence,
-                                              options=self.options)
+                                              options=generator_options)
+        self.sweeper = None
+        if self.options.get('sweep'):
+            self.sweeper = Sweeper(
+                self.model_class, filters=self.options.get('sweep_filter'),
+                update=self.options.get('sweep_update'))
 
-    def process(self, extractor):
+    def get_source_fields(self):
         """
-        This is broken out from below and should be better
-        organized.
+        Returns the names of the source fields mapped by the transformer
+        or matching model fields, None if the transformer is not a
+        Transformer subclass.
         """
+        if not issubclass(self.transformer_class, Transformer):
+            return None
+        names = set()
+        for field in get_fields(self.model_class):
+            names.add(field.name)
+            names.add(getattr(field, 'attname', field.name))
+        names.update(self.transformer_class().mappings.values())
+        return sorted(names)
 
+    def extract(self, extractor):
+        """
+        Reads and transforms the next record.
+
+        Returns:
+            tuple: The record and an error message, which is None if
+            the record is valid.
+
+        Raises:
+            StopIteration: At the end of the source.
+        """
+        dic, error = self.read(extractor)
+        if error is not None:
+            return dic, error
+        return self.transform(dic)
+
+    def read(self, extractor):
+        """
+        Reads the next record, returns the record and an error message.
+        """
         try:
-            dic = extractor.next()
+            return extractor.next(), None
             # dic = CaseInsensitiveDict(extractor.next())
         except (UnicodeDecodeError, csv.Error) as e:
-            self.logger.reject(str(e))
-            return
+            return None, str(e)
 
+    def transform(self, dic):
+        """
+        Transforms a record, returns the result and an error message.
+        """
         defaults = self.options.get('defaults') or {}
         transformer = self.transformer_class(dic, defaults=defaults)
         try:
             if transformer.is_valid():
-                dic = transformer.cleaned_data
+                return transformer.cleaned_data, None
             else:
                 raise ValidationError(transformer.error)
         except (ValidationError, ValueError, IndexError, KeyError) as e:
-            self.logger.reject(str(e), dic)
-            return
+            return dic, str(e)
 
-        try:
+    def get_error_message(self, exc):
+        if hasattr(exc, 'message_dict'):
+            return ', '.join(' '.join([f, '(%s)' % ', '.join(err)])
+                             for f, err in exc.message_dict.items())
+        return str(exc)
+
+    @contextmanager
+    def writing(self):
+        """
+        Runs a write transaction, holding write_lock if it is set.
+        """
+        if self.write_lock is None:
             with transaction.atomic():
+                yield
+        else:
+            with self.write_lock, transaction.atomic():
+                yield
+
+    def write(self, dic):
+        """
+        Writes a single record in its own transaction.
+
+        Returns:
+            tuple: The instance and the GenerationStatus, or None and
+            the exception rejecting the record.
+        """
+        try:
+            with self.writing():
                 instance = self.generator.get_instance(dic)
         except (ValidationError, IntegrityError,
                 DatabaseError, ValueError) as exc:
-            if hasattr(exc, 'message_dict'):
-                msg = ', '.join(' '.join([f, '(%s)' % ', '.join(err)])
-                                for f, err in exc.message_dict.items())
+            self.generator.rollback()
+            return None, exc
+        self.generator.commit()
+        return instance, self.generator.res
+
+    def write_batch(self, dics):
+        """
+        Writes a list of records in one transaction. If the batch fails
+        as a whole, e.g. because of an IntegrityError, it is rolled back
+        and written record by record in order to reject only the
+        offending records.
+        """
+        if not dics:
+            return []
+        try:
+            with self.writing():
+                results = self.generator.get_instances(dics)
+        except (ValidationError, IntegrityError,
+                DatabaseError, ValueError):
+            self.generator.rollback()
+            return [self.write(dic) for dic in dics]
+        self.generator.commit()
+        return results
+
+    def report(self, dic, instance, res):
+        if isinstance(res, Exception):
+            self.logger.reject(self.get_error_message(res), dic)
+        else:
+            # records bulk created without returned keys are newer than
+            # the records to sweep
+            if self.sweeper and getattr(instance, 'pk', None) is not None:
+                self.sweeper.add(instance.pk)
+            self.logger.accept(res, dic, instance)
+
+    def sweep(self):
+        """
+        Removes the records not seen during a complete load without
+        rejections.
+        """
+        if not self.sweeper:
+            return
+        if self.slice_begin or self.slice_end:
+            self.logger.status('Sweep skipped, only a slice was loaded.')
+            self.sweeper.close()
+        elif self.logger.counter.rejected:
+            self.logger.status(
+                'Sweep skipped, %s records rejected.',
+                self.logger.counter.rejected)
+            self.sweeper.close()
+        else:
+            self.logger.remove(self.sweeper.sweep())
+
+    def process(self, extractor):
+        """
+        Reads, transforms, and writes a single record.
+        """
+        dic, error = self.extract(extractor)
+        if error is not None:
+            self.logger.reject(error, dic)
+            return
+        self.report(dic, *self.write(dic))
+        self.save_checkpoint()
+
+    def process_batch(self, extractor):
+        """
+        Reads and transforms up to batch_size records and writes them
+        with a single call to the generator's get_instances. Results are
+        reported to the logger in row order.
+        """
+        size = self.batch_size
+        if self.slice_end:
+            size = min(size, self.slice_end - self.logger.counter.pos + 1)
+        records = []
+        exhausted = False
+        while len(records) < size:
+            try:
+                records.append(self.extract(extractor))
+            except StopIteration:
+                exhausted = True
+                break
+        self.write_records(records)
+        if exhausted:
+            raise StopIteration
+
+    def write_records(self, records):
+        """
+        Writes a list of (dic, error) tuples, as one batch if batch_size
+        is set, and reports the results to the logger in row order.
+        """
+        dics = [dic for dic, error in records if error is None]
+        if self.batch_size:
+            results = iter(self.write_batch(dics))
+        else:
+            results = (self.write(dic) for dic in dics)
+        for dic, error in records:
+            if error is not None:
+                self.logger.reject(error, dic)
             else:
-                msg = str(exc)
-            self.logger.reject(msg, dic)
+                self.report(dic, *next(results))
+        self.save_checkpoint()
+
+    def save_checkpoint(self, force=False):
+        """
+        Saves the checkpoint after records were committed, at most every
+        checkpoint_interval records.
+        """
+        if not self.checkpoint:
+            return
+        pos = self.logger.counter.pos
+        interval = self.options.get('checkpoint_interval') or 1000
+        if not force and pos - self.checkpoint_pos < interval:
             return
+        offset = None
+        if (self.options.get('offset_index') and
+                self.extractor.can_seek()):
+            index = self.extractor.get_offset_index()
+            if pos <= len(index):
+                offset = index[pos]
+        self.checkpoint.save(self.logger.counter, offset=offset)
+        self.checkpoint_pos = pos
 
-        self.logger.accept(self.generator.res, dic, instance)
+    def run(self, extractor):
+        """
+        Processes the records up to slice_end.
+        """
+        process = self.process_batch if self.batch_size else self.process
+        while (not self.slice_end or
+               self.slice_end >= self.logger.counter.pos):
+            try:
+                process(extractor)
+            except StopIteration:
+                break
 
     def load(self):
         """
@@ -176,19 +889,267 @@ class Loader(object):
         """
         self.logger.status('Opening %s.', self.filename)
         self.logger.start()
+        if self.resume_state:
+            self.logger.status(
+                'Resuming at row %s.', self.options.get('slice_begin'))
+            self.checkpoint.restore(self.resume_state, self.logger.counter)
 
         with self.extractor as extractor:
 
-            while self.slice_begin and self.slice_begin > self.logger.counter:
+            if getattr(self.extractor, 'skipped', 0):
+                self.logger.skip(rows=self.extractor.skipped)
+
+            if self.sweeper:
+                self.sweeper.start()
+
+            while (self.slice_begin and
+                   self.slice_begin > self.logger.counter.pos):
                 extractor.next()
                 self.logger.skip()
 
-            while not self.slice_end or self.slice_end >= self.logger.counter:
-                try:
-                    self.process(extractor)
-                except StopIteration:
-                    break
+            self.run(extractor)
 
             if self.generator.finalize():
+                self.sweep()
+                if self.checkpoint:
+                    self.checkpoint.clear()
                 self.logger.finish()
                 return self.logger.counter
+
+
+class ThreadedLoader(Loader):
+    """
+    Runs reading, transformation, and writing as a pipeline. A reader
+    thread fills a bounded queue, a pool of threads transforms the
+    records, and the calling thread writes them to the database, so
+    that disk I/O, transformation, and database latency overlap. The
+    transformer needs to be thread safe. Results are written and
+    reported in row order, per record or in batches of batch_size, and
+    the checkpoint is saved after each of them by write_records.
+
+    Options:
+        transform_workers (int): Number of transformation threads,
+            defaults to 4.
+        queue_size (int): Maximum number of records waiting in each
+            stage, defaults to 1000.
+    """
+    sentinel = object()
+
+    def __init__(self, source, model_class=None, logger=None, options=None):
+        super(ThreadedLoader, self).__init__(
+            source, model_class=model_class, logger=logger, options=options)
+        self.transform_workers = self.options.get('transform_workers') or 4
+        self.queue_size = self.options.get('queue_size') or 1000
+
+    def read_all(self, extractor, queue, stop):
+        """
+        Reader stage, puts (dic, error) tuples into the queue up to
+        slice_end, then the sentinel. Unexpected exceptions are passed
+        on to the writer.
+        """
+        def put(item):
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        remaining = None
+        if self.slice_end:
+            remaining = self.slice_end - self.logger.counter.pos + 1
+        try:
+            while remaining is None or remaining > 0:
+                try:
+                    item = self.read(extractor)
+                except StopIteration:
+                    break
+                if not put(item):
+                    return
+                if remaining is not None:
+                    remaining -= 1
+        except Exception as exc:
+            put(exc)
+        put(self.sentinel)
+
+    def transform_record(self, item):
+        dic, error = item
+        if error is not None:
+            return dic, error
+        return self.transform(dic)
+
+    def run(self, extractor):
+        queue = Queue(self.queue_size)
+        stop = threading.Event()
+        reader = threading.Thread(
+            target=self.read_all, args=(extractor, queue, stop))
+        reader.daemon = True
+        reader.start()
+        pending = deque()
+        records = []
+        size = self.batch_size or 1
+        finished = False
+        pool = ThreadPoolExecutor(self.transform_workers)
+        try:
+            while pending or not finished:
+                while not finished and len(pending) < self.queue_size:
+                    try:
+                        item = queue.get(block=not pending)
+                    except Empty:
+                        break
+                    if item is self.sentinel:
+                        finished = True
+                    elif isinstance(item, Exception):
+                        raise item
+                    else:
+                        pending.append(
+                            pool.submit(self.transform_record, item))
+                if pending:
+                    records.append(pending.popleft().result())
+                if len(records) >= size or (
+                        records and finished and not pending):
+                    self.write_records(records)
+                    records = []
+        finally:
+            stop.set()
+            pool.shutdown()
+
+
+def init_worker(loader_class, write_lock):
+    """
+    Sets the write lock shared by the worker processes.
+    """
+    loader_class.write_lock = write_lock
+
+
+def load_slice(args):
+    """
+    Runs a loader for a single slice in a worker process and returns
+    its counter. Database connections inherited from the parent process
+    are closed first so that every worker opens its own.
+    """
+    loader_class, source, model_class, logger_class, options = args
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
+    try:
+        loader = loader_class(source, model_class=model_class,
+                              logger=logger_class(), options=options)
+        return loader.load()
+    finally:
+        connections.close_all()
+
+
+class ParallelLoader(Loader):
+    """
+    Loads the source in slices in a pool of worker processes, each one
+    running the regular per-record or batched pipeline. The source
+    needs to be a path and the loader class importable, since both are
+    passed on to the workers. Counters of the workers are merged and
+    reported by the loader's logger.
+
+    The options checkpoint and resume are not supported, the workers
+    would share one checkpoint file, neither is sweep, since the keys
+    seen by each worker are kept in its own connection.
+
+    SQLite fails concurrent write transactions with "database is
+    locked", so on SQLite the workers take turns writing and only read
+    and transform in parallel.
+
+    Unless the offset_index option is set, count() parses the whole
+    source once more before the workers start, in order to partition
+    it. Readers with a length method, such as OGRReader, are not
+    affected.
+
+    Options:
+        workers (int): Number of worker processes, defaults to the
+            number of CPUs. With a single worker the source is loaded
+            in the current process.
+    """
+    worker_logger_class = WorkerLogger
+    unsupported_options = ['checkpoint', 'resume', 'sweep']
+
+    def __init__(self, source, model_class=None, logger=None, options=None):
+        for name in self.unsupported_options:
+            if (options or {}).get(name):
+                raise ValueError(
+                    'ParallelLoader does not support the option {}.'.format(
+                        name))
+        super(ParallelLoader, self).__init__(
+            source, model_class=model_class, logger=logger, options=options)
+        self.workers = (
+            self.options.get('workers') or multiprocessing.cpu_count())
+
+    def count(self):
+        """
+        Returns the number of records in the source. Uses the offset
+        index or the length method of the reader where available,
+        otherwise reads every record, which takes about as long as
+        parsing the source in a worker.
+        """
+        if (self.options.get('offset_index') and
+                self.extractor.can_seek()):
+            return len(self.extractor.get_offset_index())
+        extractor = self.extractor_class(self.source, self.reader_class,
+                                         self.reader_kwargs,
+                                         options=self.options)
+        with extractor as reader:
+            if hasattr(reader, 'length'):
+                return reader.length()
+            total = 0
+            while True:
+                try:
+                    reader.next()
+                except StopIteration:
+                    return total
+                except (UnicodeDecodeError, csv.Error):
+                    pass
+                total += 1
+
+    def get_slices(self, total):
+        """
+        Partitions rows slice_begin to slice_end, or all rows, into
+        one (slice_begin, slice_end) tuple per worker.
+        """
+        begin = self.slice_begin or 1
+        end = min(self.slice_end or total, total)
+        if end < begin:
+            return []
+        size = -(-(end - begin + 1) // self.workers)
+        return [(start, min(start + size - 1, end))
+                for start in range(begin, end + 1, size)]
+
+    def load(self):
+        if self.workers <= 1 or hasattr(self.source, 'read'):
+            return super(ParallelLoader, self).load()
+        self.logger.status('Opening %s.', self.filename)
+        self.logger.start()
+        options = dict(self.options, workers=1)
+        # byte offsets of slice_offset only apply to slice_begin
+        options.pop('slice_offset', None)
+        args = [
+            (self.__class__, self.source, self.model_class,
+             self.worker_logger_class,
+             dict(options, slice_begin=begin, slice_end=end))
+            for begin, end in self.get_slices(self.count())]
+        write_lock = None
+        if connections[
+                router.db_for_write(self.model_class)].vendor == 'sqlite':
+            write_lock = multiprocessing.Lock()
+        connections.close_all()
+        pool = multiprocessing.Pool(
+            min(self.workers, len(args) or 1), initializer=init_worker,
+            initargs=(self.__class__, write_lock))
+        try:
+            for counter in pool.imap_unordered(load_slice, args):
+                if counter:
+                    self.logger.counter.merge(counter)
+        finally:
+            pool.close()
+            pool.join()
+        if self.generator.finalize():
+            self.logger.finish()
+            return self.logger.counter
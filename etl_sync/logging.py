@@ -11,11 +11,12 @@ class Counter(object):
         self.rejected = 0
         self.created = 0
         self.updated = 0
+        self.removed = 0
         self.start_time = datetime.now()
         self.finish_time = None
 
-    def next(self):
-        self.pos += 1
+    def next(self, rows=1):
+        self.pos += rows
 
     def finish(self):
         self.finish_time = datetime.now()
@@ -32,6 +33,18 @@ class Counter(object):
         self.rejected += 1
         self.next()
 
+    def merge(self, other):
+        """
+        Adds the results of another counter, e.g. from a worker process
+        that loaded a different slice of the same source.
+        """
+        self.pos = max(self.pos, other.pos)
+        self.rejected += other.rejected
+        self.created += other.created
+        self.updated += other.updated
+        self.removed += other.removed
+        self.start_time = min(self.start_time, other.start_time)
+
     @property
     def time(self):
         return self.finish_time - self.start_time
@@ -69,8 +82,14 @@ class BaseLogger:
     def reject(self, msg, dic=None):
         self.counter.reject()
 
-    def skip(self, msg=None):
-        self.counter.next()
+    def skip(self, msg=None, rows=1):
+        self.counter.next(rows)
+
+    def remove(self, count):
+        """
+        Reports the number of records removed by a sweep.
+        """
+        self.counter.removed += count
 
 
 class StdoutLogger(BaseLogger):
@@ -90,6 +109,10 @@ class StdoutLogger(BaseLogger):
             '{} created'.format(self.counter.created),
             '{} updated'.format(self.counter.updated),
             '{} rejected'.format(self.counter.rejected),
+        ]
+        if self.counter.removed:
+            lines.append('{} removed'.format(self.counter.removed))
+        lines += [
             '',
             'Data extraction finished {}'.format(self.counter.finish_time),
             'Time spent: {}'.format(self.counter.time),
@@ -98,3 +121,16 @@ class StdoutLogger(BaseLogger):
         if msg:
             lines.append(msg)
         print('\n'.join(lines))
+
+
+class WorkerLogger(StdoutLogger):
+    """
+    Reports rejected records only. Used in the worker processes of
+    ParallelLoader, which reports the merged counters.
+    """
+
+    def status(self, msg, *args):
+        pass
+
+    def finish(self, msg=None):
+        BaseLogger.finish(self, msg)
@@ -0,0 +1,241 @@
+from __future__ import absolute_import
+
+import datetime
+import io
+import json
+from builtins import str as text
+from collections import OrderedDict
+
+from django.db import connections, router, transaction
+
+from .generators import InstanceGenerator, get_internal_type
+from .types import GenerationStatus
+
+
+class CopyGenerator(InstanceGenerator):
+    """
+    InstanceGenerator for PostgreSQL writing batches through a temporary
+    staging table. The prepared records of a batch are streamed into the
+    staging table with COPY FROM STDIN in CSV format and merged into the
+    target table with a single INSERT ... ON CONFLICT DO UPDATE. Whether
+    a record was created or updated is taken from the merge.
+
+    Use it with the batch_size option of the Loader, large batches pay
+    off. Batches are written with the regular bulk operations of
+    InstanceGenerator if the database is not PostgreSQL, the model
+    inherits from another model, records set etl_create or etl_update to
+    False, or the rows are not persisted by a single unique field,
+    unique_together or unique constraint, e.g. with HashMixin.
+    """
+    staging_prefix = 'etl_staging_'
+
+    def get_connection(self):
+        return connections[router.db_for_write(self.model_class)]
+
+    def can_copy(self, rows):
+        """
+        Returns the conflict target for merging rows through a staging
+        table, None if the batch needs to be written otherwise.
+        """
+        if self.get_connection().vendor != 'postgresql':
+            return None
+        if self.model_class._meta.parents:
+            return None
+        if not all(row.create and row.update for row in rows):
+            return None
+        return self.get_conflict_fields(rows)
+
+    def load_rows(self, rows):
+        conflict_fields = self.can_copy(rows) if rows else None
+        if not conflict_fields:
+            return super(CopyGenerator, self).load_rows(rows)
+        groups = OrderedDict()
+        for row in rows:
+            row.dic = {
+                name: value for name, value in row.dic.items()
+                if name in self.field_names}
+            groups.setdefault(frozenset(row.dic), []).append(row)
+        # rows with different fields would overwrite each other's missing
+        # fields with defaults, merge them separately
+        for group in groups.values():
+            self.merge_rows(group, conflict_fields)
+        self.relate_rows(rows)
+
+    def get_staging_table(self):
+        return (self.staging_prefix + self.model_class._meta.db_table)[:63]
+
+    def format_value(self, value):
+        """
+        Formats a database value as CSV field for COPY. Only unquoted
+        empty fields are read as NULL.
+        """
+        if value is None:
+            return ''
+        if isinstance(value, (list, tuple)):
+            value = self.format_array(value)
+        else:
+            value = self.to_text(value)
+        return '"' + value.replace('"', '""') + '"'
+
+    def to_text(self, value):
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return '\\x' + bytes(value).hex()
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        return text(value)
+
+    def format_array(self, values):
+        """
+        Formats a list as PostgreSQL array literal, e.g. {"a","b c"}.
+        """
+        items = []
+        for value in values:
+            if value is None:
+                items.append('NULL')
+            elif isinstance(value, (list, tuple)):
+                items.append(self.format_array(value))
+            else:
+                items.append('"' + self.to_text(value).replace(
+                    '\\', '\\\\').replace('"', '\\"') + '"')
+        return '{' + ','.join(items) + '}'
+
+    def get_copy_value(self, field, instance, connection):
+        value = field.pre_save(instance, True)
+        if hasattr(value, 'hexewkb'):
+            # geometries, PostGIS reads hex encoded EWKB
+            value = self.get_geometry(field, value).hexewkb
+            return self.format_value(
+                value.decode() if isinstance(value, bytes) else value)
+        if value is not None and get_internal_type(field) == 'JSONField':
+            # the database adapters of JSON values are no valid CSV
+            return self.format_value(
+                json.dumps(value, cls=getattr(field, 'encoder', None)))
+        return self.format_value(field.get_db_prep_save(value, connection))
+
+    def get_geometry(self, field, geom):
+        """
+        Returns geom in the spatial reference of field. Geometries
+        without SRID are assumed to be in it already, like on save.
+        """
+        srid = getattr(field, 'srid', None)
+        if srid is None or geom.srid == srid:
+            return geom
+        geom = geom.clone()
+        if geom.srid is None:
+            geom.srid = srid
+        else:
+            geom.transform(srid)
+        return geom
+
+    def copy_to_db(self, cursor, sql, stream):
+        """
+        Runs COPY FROM STDIN with psycopg2 or psycopg 3.
+        """
+        raw = cursor.cursor
+        if hasattr(raw, 'copy_expert'):
+            raw.copy_expert(sql, stream)
+        else:
+            with raw.copy(sql) as copy:
+                copy.write(stream.getvalue())
+
+    def stage_rows(self, rows, fields, conflict_fields, connection):
+        """
+        Returns the CSV data for the staging table and a list of
+        [instance, rows] entries, one per line. Rows sharing the values
+        of the conflict target are merged into the last one.
+        """
+        targets = [fields.index(self.model_class._meta.get_field(name))
+                   for name in conflict_fields]
+        entries = OrderedDict()
+        for row in rows:
+            instance = self.model_class(**row.dic)
+            values = [self.get_copy_value(field, instance, connection)
+                      for field in fields]
+            key = tuple(values[index] for index in targets)
+            if '' in key:
+                row.res = ValueError(
+                    'Values of {} are required.'.format(
+                        ', '.join(conflict_fields)))
+                continue
+            entry = entries.pop(key, [None, None, []])
+            entry[0:2] = instance, values
+            entry[2].append(row)
+            entries[key] = entry
+        stream = io.StringIO()
+        lines = []
+        for number, (instance, values, merged) in enumerate(
+                entries.values()):
+            stream.write(','.join([text(number)] + values) + '\n')
+            lines.append((instance, merged))
+        stream.seek(0)
+        return stream, lines
+
+    def merge_rows(self, rows, conflict_fields):
+        """
+        Writes rows with the same fields through the staging table.
+        """
+        meta = self.model_class._meta
+        connection = self.get_connection()
+        quote = connection.ops.quote_name
+        fields = [field for field in meta.concrete_fields
+                  if not field.primary_key]
+        stream, lines = self.stage_rows(
+            rows, fields, conflict_fields, connection)
+        if not lines:
+            return
+        names = set(rows[0].dic)
+        targets = [meta.get_field(name) for name in conflict_fields]
+        updates = [
+            field for field in fields
+            if (field.name in names or getattr(field, 'auto_now', False))
+            and field not in targets] or targets[0:1]
+        table = quote(meta.db_table)
+        staging = quote(self.get_staging_table())
+        columns = ', '.join(quote(field.column) for field in fields)
+        sql = (
+            'WITH merged AS ('
+            'INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} '
+            'ON CONFLICT ({targets}) DO UPDATE SET {updates} '
+            'RETURNING {table}.{pk} AS etl_pk, '
+            '{table}.xmax = 0 AS etl_created, {keys}) '
+            'SELECT {staging}.etl_row, merged.etl_pk, merged.etl_created '
+            'FROM merged JOIN {staging} ON {join}').format(
+                table=table, columns=columns, staging=staging,
+                pk=quote(meta.pk.column),
+                targets=', '.join(quote(field.column) for field in targets),
+                updates=', '.join(
+                    '{0} = EXCLUDED.{0}'.format(quote(field.column))
+                    for field in updates),
+                keys=', '.join(
+                    '{}.{} AS etl_key{}'.format(table, quote(field.column), n)
+                    for n, field in enumerate(targets)),
+                join=' AND '.join(
+                    '{}.{} = merged.etl_key{}'.format(
+                        staging, quote(field.column), n)
+                    for n, field in enumerate(targets)))
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute('DROP TABLE IF EXISTS {}'.format(staging))
+                cursor.execute(
+                    'CREATE TEMPORARY TABLE {} AS SELECT 0 AS etl_row, {} '
+                    'FROM {} WITH NO DATA'.format(staging, columns, table))
+                self.copy_to_db(
+                    cursor, 'COPY {} (etl_row, {}) FROM STDIN '
+                    'WITH (FORMAT csv)'.format(staging, columns), stream)
+                cursor.execute(sql)
+                results = cursor.fetchall()
+                cursor.execute('DROP TABLE {}'.format(staging))
+        for number, pk, created in results:
+            instance, merged = lines[number]
+            instance.pk = pk
+            instance._state.adding = False
+            instance._state.db = connection.alias
+            for row in merged:
+                row.instance = instance
+                row.res = GenerationStatus.Updated
+            if created:
+                merged[0].res = GenerationStatus.Created
+            elif self.related_cache is not None:
+                self.related_cache.invalidate(instance)
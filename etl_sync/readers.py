@@ -2,7 +2,9 @@
 from __future__ import print_function
 from future.utils import iteritems
 
+import datetime
 import warnings
+from collections import deque
 from osgeo import osr, ogr
 
 
@@ -41,17 +43,42 @@ class OGRReader(object):
         target_epsg (Optional[int]): Spatial reference. Defaults to 4326.
         feature_class_name (Optional[bytes]): Name of the feature class within ds.
             Defaults to the first returned by GDAL.
+        geometry_format (Optional[str]): 'wkt' (default) or 'wkb', which
+            returns geometries as WKB bytearray and saves converting
+            them to and from text.
+        attribute_filter (Optional[str]): OGR SQL WHERE clause, features
+            not matching are skipped by GDAL.
+        spatial_filter (Optional): Bounding box as (min x, min y, max x,
+            max y), WKT string, or ogr.Geometry in the target spatial
+            reference. Only features intersecting it are read.
+        fields (Optional[list]): Names of the fields to read, GDAL skips
+            the others. Geometries are skipped unless 'geometry' is
+            listed. Matched case insensitively.
+        block_size (Optional[int]): Reads features in blocks of this size
+            and reprojects the coordinates of all point geometries of a
+            block with a single call of TransformPoints. Defaults to
+            reprojecting feature by feature.
+        traditional_axis_order (Optional[bool]): Return coordinates in
+            x/y (lon/lat) order on GDAL 3 and later also for targets such
+            as EPSG:4326 whose authority defines lat/lon. Defaults to
+            the axis order of the authority.
     """
+    accepts_fields = True
 
     def __init__(self, source, encoding='utf-8',
                  delimiter='', quoting='', target_epsg=4326,
-                 feature_class_name=''):
+                 feature_class_name='', geometry_format='wkt',
+                 attribute_filter=None, spatial_filter=None, fields=None,
+                 block_size=None, traditional_axis_order=False):
         # if source already open, close and reopen in OGR
         if hasattr(source, 'name'):
             s = source.name
             source.close()
             source = s
         self.encoding = encoding
+        self.geometry_format = geometry_format
+        self.block_size = block_size
+        self.block = deque()
         self.ds = ogr.Open(source)
         if not feature_class_name:
             self.layer = self.ds.GetLayer(0)
@@ -61,12 +88,60 @@ class OGRReader(object):
         source = self.layer.GetSpatialRef()
         target = osr.SpatialReference()
         target.ImportFromEPSG(target_epsg)
-        self.transform = osr.CoordinateTransformation(source, target)
+        if (traditional_axis_order and
+                hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER')):
+            target.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        if source is None or source.IsSame(target):
+            # nothing to reproject
+            self.transform = None
+        else:
+            self.transform = osr.CoordinateTransformation(source, target)
+        if attribute_filter:
+            self.layer.SetAttributeFilter(attribute_filter)
+        if spatial_filter is not None:
+            self.layer.SetSpatialFilter(
+                self.get_filter_geometry(spatial_filter, source, target))
+        if fields is not None:
+            self.layer.SetIgnoredFields(self.get_ignored_fields(fields))
+
+    def get_filter_geometry(self, spatial_filter, source, target):
+        """
+        Returns the spatial filter as ogr.Geometry in the spatial
+        reference of the layer.
+        """
+        if isinstance(spatial_filter, ogr.Geometry):
+            geom = spatial_filter.Clone()
+        elif isinstance(spatial_filter, (tuple, list)):
+            geom = ogr.CreateGeometryFromWkt(
+                'POLYGON (({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1}))'
+                .format(*spatial_filter))
+        else:
+            geom = ogr.CreateGeometryFromWkt(spatial_filter)
+        if source is not None:
+            geom.Transform(osr.CoordinateTransformation(target, source))
+        return geom
+
+    def get_ignored_fields(self, fields):
+        wanted = set(name.lower() for name in fields)
+        defn = self.layer.GetLayerDefn()
+        ignored = [
+            defn.GetFieldDefn(index).GetName()
+            for index in range(defn.GetFieldCount())
+            if defn.GetFieldDefn(index).GetName().lower() not in wanted]
+        if 'geometry' not in wanted:
+            ignored.append('OGR_GEOMETRY')
+        return ignored
 
     def length(self):
         return self.layer.GetFeatureCount()
 
     def next(self):
+        if self.block_size and self.transform is not None:
+            if not self.block:
+                self.block.extend(self.read_block())
+            if not self.block:
+                raise StopIteration
+            return self.block.popleft()
         feature = self.layer.GetNextFeature()
         try:
             ret = feature.items()
@@ -76,10 +151,156 @@ class OGRReader(object):
             ret = unicode_dic(ret, self.encoding)
             ogr_geom = feature.geometry()
             if ogr_geom:
-                ogr_geom.Transform(self.transform)
-                ret['geometry'] = ogr_geom.ExportToWkt()
+                if self.transform is not None:
+                    ogr_geom.Transform(self.transform)
+                ret['geometry'] = self.export_geometry(ogr_geom)
             return ret
 
+    def read_block(self):
+        """
+        Returns the next block_size features as dictionaries. Point
+        coordinates are collected and reprojected in one call, other
+        geometries one by one.
+        """
+        rows = []
+        points = []
+        pending = []
+        for _ in range(self.block_size):
+            feature = self.layer.GetNextFeature()
+            if feature is None:
+                break
+            ret = unicode_dic(feature.items(), self.encoding)
+            rows.append(ret)
+            ogr_geom = feature.geometry()
+            if not ogr_geom:
+                continue
+            geom_type = ogr_geom.GetGeometryType()
+            if (geom_type in (ogr.wkbPoint, ogr.wkbPoint25D) and
+                    not ogr_geom.IsEmpty()):
+                points.append(ogr_geom.GetPoint())
+                # the feature owns the geometry, keep it alive
+                pending.append((ret, ogr_geom, feature))
+            else:
+                ogr_geom.Transform(self.transform)
+                ret['geometry'] = self.export_geometry(ogr_geom)
+        if points:
+            for (ret, ogr_geom, _), point in zip(
+                    pending, self.transform.TransformPoints(points)):
+                if ogr_geom.GetGeometryType() == ogr.wkbPoint:
+                    ogr_geom.SetPoint_2D(0, point[0], point[1])
+                else:
+                    ogr_geom.SetPoint(0, point[0], point[1], point[2])
+                ret['geometry'] = self.export_geometry(ogr_geom)
+        return rows
+
+    def export_geometry(self, ogr_geom):
+        if self.geometry_format == 'wkb':
+            return ogr_geom.ExportToWkb(ogr.wkbNDR)
+        return ogr_geom.ExportToWkt()
+
+
+class OGRArrowReader(OGRReader):
+    """
+    OGRReader fetching record batches through the Arrow stream interface
+    of GDAL 3.6 and later, which avoids the per-feature overhead of
+    GetNextFeature. Values are converted column by column into the
+    Python values OGRReader returns, dates as strings in the format of
+    OGR. Time zones are lost, the Arrow stream converts date times to
+    UTC. Falls back to reading feature by feature on earlier versions
+    of GDAL.
+
+    Args:
+        batch_size (Optional[int]): Maximum number of features per batch.
+            Other arguments as for OGRReader.
+    """
+
+    def __init__(self, source, batch_size=65536, **kwargs):
+        super(OGRArrowReader, self).__init__(source, **kwargs)
+        self.batch_size = batch_size
+        self.stream = None
+        self.rows = iter(())
+
+    def supports_arrow(self):
+        return hasattr(self.layer, 'GetArrowStreamAsNumPy')
+
+    def convert_wkb(self, wkb):
+        if wkb is None:
+            return None
+        if self.transform is None and self.geometry_format == 'wkb':
+            return bytes(wkb)
+        ogr_geom = ogr.CreateGeometryFromWkb(bytes(wkb))
+        if self.transform is not None:
+            ogr_geom.Transform(self.transform)
+        return self.export_geometry(ogr_geom)
+
+    def format_date(self, value):
+        """
+        Formats dates and times like OGR, e.g. 2020/01/31 10:30:15.123.
+        """
+        if isinstance(value, datetime.datetime):
+            text = value.strftime('%Y/%m/%d %H:%M:%S')
+        elif isinstance(value, datetime.date):
+            return value.strftime('%Y/%m/%d')
+        elif isinstance(value, datetime.time):
+            text = value.strftime('%H:%M:%S')
+        else:
+            return value
+        if value.microsecond:
+            text += '.{:03d}'.format(value.microsecond // 1000)
+        return text
+
+    def convert_column(self, values):
+        """
+        Returns the values of a column as list of Python values.
+        """
+        values = values.tolist()
+        return [
+            value.decode(self.encoding) if isinstance(value, bytes)
+            else self.format_date(value) for value in values]
+
+    def batches(self):
+        """
+        Yields the features in batches of up to batch_size as
+        dictionaries of value lists, geometries in the column geometry.
+        """
+        geometry_column = self.layer.GetGeometryColumn() or 'wkb_geometry'
+        stream = self.layer.GetArrowStreamAsNumPy(options=[
+            'MAX_FEATURES_IN_BATCH={}'.format(self.batch_size),
+            'INCLUDE_FID=NO', 'GEOMETRY_ENCODING=WKB'])
+        for batch in stream:
+            columns = {}
+            for name, values in iteritems(batch):
+                if name == geometry_column:
+                    columns['geometry'] = [
+                        self.convert_wkb(value) for value in values.tolist()]
+                else:
+                    columns[name] = self.convert_column(values)
+            yield columns
+
+    def next(self):
+        if not self.supports_arrow():
+            return super(OGRArrowReader, self).next()
+        if self.stream is None:
+            self.stream = self.batches()
+        while True:
+            try:
+                return next(self.rows)
+            except StopIteration:
+                pass
+            # raises StopIteration after the last batch
+            columns = next(self.stream)
+            names = list(columns)
+            self.rows = (
+                self.get_row(names, values)
+                for values in zip(*[columns[name] for name in names]))
+
+    def get_row(self, names, values):
+        row = dict(zip(names, values))
+        # like OGRReader, no geometry key for features without geometry
+        if row.get('geometry', True) is None:
+            del row['geometry']
+        return row
+
 
 class ShapefileReader(OGRReader):
     """
@@ -9,7 +9,12 @@ from django.core.exceptions import ValidationError
 class Transformer(object):
     """Base transformer. Django forms can be used instead.
     This class contains only the bare minimum of methods
-    and is able to process a list of forms."""
+    and is able to process a list of forms.
+
+    Flattened mappings, compiled blacklist patterns and split relation
+    names are cached on the class, creating a transformer per row is
+    cheap.
+    """
 
     # {'': Form1, 'nested_field': Form2, 'nested1.nested2: Form3, ... ]
     forms = {}
@@ -19,12 +24,32 @@ class Transformer(object):
     # dictionary of fieldnames and regexes for invalid values
     blacklist = {}
     defaults = {}
+    # maximum number of dotted relation names cached per class
+    relation_paths_size = 1000
 
-    def __init__(self, dic, defaults=None):
+    def __init__(self, dic=None, defaults=None):
         self.dic = dic
         if defaults:
             self.defaults = defaults
-        self.mappings = self._flatten_mappings()
+        self.mappings = self.get_compiled('mappings', self._flatten_mappings)
+
+    def get_compiled(self, name, compile_function):
+        """
+        Returns compile_function() for the current value of attribute
+        name. Results for the class attribute are cached on the class,
+        results for values set on the instance on the instance.
+        """
+        source = getattr(self, name)
+        cache_name = '_compiled_' + name
+        cached = getattr(self, cache_name, None)
+        if cached is not None and cached[0] is source:
+            return cached[1]
+        cached = (source, compile_function())
+        if source is getattr(type(self), name):
+            setattr(type(self), cache_name, cached)
+        else:
+            setattr(self, cache_name, cached)
+        return cached[1]
 
     def _flatten_mappings(self, prefix=None, dic=None):
         def with_prefix(n):
@@ -71,21 +96,56 @@ class Transformer(object):
         dictionary.update(dic)
         return dictionary
 
+    def _compile_blacklist(self):
+        """
+        Merges the plain string patterns of each field into a single
+        regular expression. Compiled patterns, which may have flags,
+        and patterns with groups, flags or errors are kept separately.
+        """
+        default_flags = re.compile('').flags
+        res = {}
+        for key, value in iteritems(self.blacklist):
+            plain = []
+            separate = []
+            for v in value:
+                try:
+                    compiled = re.compile(v) if isinstance(v, str) else None
+                except re.error:
+                    compiled = None
+                if (compiled is not None and compiled.groups == 0 and
+                        compiled.flags == default_flags):
+                    plain.append(v)
+                else:
+                    separate.append(v)
+            if len(plain) > 1:
+                plain = [re.compile(
+                    '|'.join('(?:{})'.format(v) for v in plain))]
+            if plain or separate:
+                res[key] = plain + separate
+        return res
+
     def check_blacklist(self, dic):
         """
         Raise ValidationError if value or pattern is
         black-listed.
         """
-        for key, value in iteritems(self.blacklist):
-            for v in value:
+        compiled = self.get_compiled('blacklist', self._compile_blacklist)
+        for key, patterns in iteritems(compiled):
+            value = dic[key]
+            for pattern in patterns:
                 try:
-                    if re.match(v, dic[key]):
-                        raise ValidationError(
-                            'Value {} not allowed in field {}'.format(
-                                v, key))
+                    if re.match(pattern, value):
+                        break
                 except TypeError:
                     raise ValidationError(
                         'Black list test failed, check your blacklist.')
+            else:
+                continue
+            # report the first matching pattern of the original list
+            for v in self.blacklist[key]:
+                if re.match(v, value):
+                    raise ValidationError(
+                        'Value {} not allowed in field {}'.format(v, key))
 
     def validate(self, dic):
         """Raise validation errors here."""
@@ -112,13 +172,30 @@ class Transformer(object):
         for name, value in dic.items():
             if name is None:
                 continue
+            parts = self.get_relation_path(name)
             p = data
-            parts = name.split('.')
             for n in parts[:-1]:
                 p = p[n]
             p[parts[-1]] = value
         return data
 
+    def get_relation_path(self, name):
+        """
+        Returns the parts of the dotted relation name. They are cached
+        on the class, the cache is emptied when it is full.
+        """
+        cls = type(self)
+        paths = cls.__dict__.get('_relation_paths')
+        if paths is None:
+            paths = {}
+            cls._relation_paths = paths
+        parts = paths.get(name)
+        if parts is None:
+            if len(paths) >= self.relation_paths_size:
+                paths.clear()
+            parts = paths[name] = tuple(name.split('.'))
+        return parts
+
     def _clean_relations(self, dic):
         def clean_dic(d):
             res = {}
@@ -152,6 +229,8 @@ class Transformer(object):
         return self.full_transform(dic)
 
     def is_valid(self):
+        self.cleaned_data = None
+        self.error = None
         try:
             self.cleaned_data = self.clean(self.dic)
             return True
@@ -1,9 +1,13 @@
 import os
+import tempfile
 
 DATABASES = {
     'default': {
         'ENGINE': 'django.contrib.gis.db.backends.spatialite',
-        'NAME': 'test.db'
+        'NAME': 'test.db',
+        # on disk, so that ParallelLoader workers share it
+        'TEST': {'NAME': os.path.join(
+            tempfile.gettempdir(), 'django_etl_sync_test.db')},
     }
 }
 MEDIA_ROOT = os.path.dirname(os.path.realpath(__file__))+'/tests',
@@ -1,16 +1,24 @@
 from __future__ import absolute_import
 
-from django.forms.models import model_to_dict
-from django.utils import version
-from django.db import IntegrityError
-from django.db.models import Model
+from datetime import datetime
+from hashlib import md5
+from unittest import mock, skipUnless
+
+from django.utils import timezone, version
+from django.db import IntegrityError, connection, transaction
+from django.db.models.signals import m2m_changed
 from django.contrib.gis.db.models import CharField
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.forms.utils import from_current_timezone
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from six import text_type
 from tests import models
 from etl_sync.generators import (
-    get_unique_fields, get_unambiguous_fields, get_fields,
-    BaseGenerator, InstanceGenerator, HashMixin)
+    get_unambiguous_fields, get_fields,
+    BaseGenerator, BatchRow, InstanceGenerator, HashIndex, HashMixin,
+    PersistenceIndex, RelatedCache)
+from etl_sync.types import GenerationStatus
 
 
 VERSION = version.get_version()[2]
@@ -18,12 +26,6 @@ VERSION = version.get_version()[2]
 
 class TestUtils(TestCase):
 
-    def test_get_unique_fields(self):
-        self.assertEqual(
-            get_unique_fields(models.Polish), ['record'])
-        self.assertEqual(get_unique_fields(models.TwoUnique),
-            ['record', 'anotherfield'])
-
     def test_get_unambigous_fields(self):
         results = [
             (models.TestModelWoFk, []),
@@ -358,6 +360,62 @@ class TestPreparations(TestCase):
             'datetimenotnull': '2014-10-14', 'datetimenull': ''})
         self.assertEqual(generator.res, 'created')
 
+    def test_prepare_geometry_wkb(self):
+        from django.contrib.gis.geos import GEOSGeometry
+        geom = GEOSGeometry('POINT (1 2 3)', srid=4326)
+        generator = InstanceGenerator(models.GeometryModel)
+        field = models.GeometryModel._meta.get_field('geom2d')
+        res = generator.prepare_geometry(field, bytearray(geom.wkb))
+        self.assertFalse(res.hasz)
+        self.assertEqual(res.coords, (1.0, 2.0))
+        res = generator.prepare_geometry(field, geom)
+        self.assertEqual((res.hasz, res.srid), (False, 4326))
+        field = models.GeometryModel._meta.get_field('geom3d')
+        res = generator.prepare_geometry(field, bytes(geom.wkb))
+        self.assertEqual(res.coords, (1.0, 2.0, 3.0))
+
+    def test_parse_date(self):
+        generator = InstanceGenerator(models.DateTimeModel)
+        field = models.DateTimeModel._meta.get_field('datetimenotnull')
+        self.assertEqual(
+            generator.prepare_date(field, ' 2014-10-14T10:00:00 '),
+            from_current_timezone(datetime(2014, 10, 14, 10)))
+        self.assertEqual(
+            generator.prepare_date(field, '10/14/2014 10:30'),
+            from_current_timezone(datetime(2014, 10, 14, 10, 30)))
+        self.assertEqual(generator.date_formats, {field.name: '%m/%d/%Y %H:%M'})
+        with self.assertRaises(ValidationError):
+            generator.prepare_date(field, '3333')
+        with self.assertRaises(ValidationError):
+            generator.prepare_date(field, '')
+        field = models.DateTimeModel._meta.get_field('datetimenull')
+        self.assertIsNone(generator.prepare_date(field, ''))
+
+    def test_parse_date_offset(self):
+        generator = InstanceGenerator(models.DateTimeModel)
+        field = models.DateTimeModel._meta.get_field('datetimenotnull')
+        value = '2020-01-01T00:00:00+02:00'
+        with override_settings(USE_TZ=False, TIME_ZONE='UTC'):
+            self.assertEqual(generator.prepare_date(field, value),
+                             datetime(2019, 12, 31, 22))
+        with override_settings(USE_TZ=True, TIME_ZONE='UTC'):
+            self.assertEqual(
+                generator.prepare_date(field, value),
+                timezone.make_aware(datetime(2019, 12, 31, 22)))
+
+    def test_parse_date_without_fromisoformat(self):
+        # Python 3.6
+        generator = InstanceGenerator(models.DateTimeModel)
+        field = models.DateTimeModel._meta.get_field('datetimenotnull')
+        with mock.patch('etl_sync.generators.datetime',
+                        mock.Mock(spec=['strptime'],
+                                  strptime=datetime.strptime)):
+            self.assertEqual(
+                generator.prepare_date(field, '2014-10-14 10:00:00'),
+                from_current_timezone(datetime(2014, 10, 14, 10)))
+            with self.assertRaises(ValidationError):
+                generator.prepare_date(field, '3333')
+
     def test_prepare_string(self):
         generator = InstanceGenerator(models.TestModel)
         res = generator.prepare_text(CharField(max_length=4), 'test')
@@ -365,6 +423,14 @@ class TestPreparations(TestCase):
         res = generator.prepare_text(CharField(max_length=3), 'test')
         self.assertEqual(res, 'tes')
 
+    def test_field_plan(self):
+        plan = InstanceGenerator.get_field_plan(models.SomeModel)
+        self.assertIs(InstanceGenerator.get_field_plan(models.SomeModel), plan)
+        methods = dict((item[0], item[2]) for item in plan)
+        self.assertEqual(methods['record'], 'prepare_text')
+        self.assertEqual(methods['lnames'], 'prepare_m2m')
+        self.assertIsNone(methods['intermediatemodel'])
+
     def test_prepare(self):
         """Testing whether result gets properly added to dic."""
         generator = InstanceGenerator(models.WellDefinedModel)
@@ -414,6 +480,485 @@ class TestHashing(TestCase):
         self.assertEqual(generator.res, 'created')
 
 
+class TestHashAlgorithms(TestCase):
+
+    class HashGenerator(HashMixin, InstanceGenerator):
+        hash_algorithm = 'blake2b'
+
+    def test_legacy(self):
+        generator = TestHashing.HashGenerator(models.HashTestModel)
+        self.assertEqual(
+            generator.hash({'zahl': 'b', 'record': 'a', 'id': 1}),
+            md5(b'ab').hexdigest())
+        self.assertEqual(
+            generator.hash({'record': 'ab', 'zahl': ''}),
+            generator.hash({'record': 'a', 'zahl': 'b'}))
+
+    def test_length_prefixed(self):
+        generator = self.HashGenerator(models.HashTestModel)
+        value = generator.hash({'record': 'a', 'zahl': 'b'})
+        self.assertEqual(len(value), 32)
+        self.assertEqual(
+            value, generator.hash({'zahl': 'b', 'record': 'a', 'id': 1}))
+        self.assertNotEqual(
+            value, generator.hash({'record': 'ab', 'zahl': ''}))
+        self.assertNotEqual(
+            generator.hash({'record': 'a', 'zahl': None}),
+            generator.hash({'record': 'a', 'zahl': 'None'}))
+        generator.hash_algorithm = 'md5'
+        self.assertNotEqual(
+            value, generator.hash({'record': 'a', 'zahl': 'b'}))
+        instance = generator.get_instance({'record': '1', 'zahl': 'b'})
+        self.assertEqual(len(instance.md5), 32)
+
+
+class TestHashIndex(TestCase):
+
+    class HashGenerator(HashMixin, InstanceGenerator):
+        pass
+
+    def test_index(self):
+        for item in ['b' * 32, 'a' * 32, 'none']:
+            models.HashTestModel.objects.create(record=item[0:10], md5=item)
+        index = HashIndex(models.HashTestModel, 'md5')
+        with self.assertNumQueries(1):
+            index.load()
+        self.assertEqual(len(index.digests), 32)
+        pk = models.HashTestModel.objects.get(md5='a' * 32).pk
+        with self.assertNumQueries(0):
+            self.assertEqual(index.get('a' * 32), pk)
+            self.assertIsNone(index.get('c' * 32))
+            self.assertIsNotNone(index.get('none'))
+        pk = index.get('b' * 32)
+        index.add('c' * 32, pk)
+        self.assertIsNone(index.get('b' * 32))
+        self.assertEqual(index.get('c' * 32), pk)
+
+    def test_index_chunks(self):
+        digests = [md5(text_type(item).encode()).hexdigest()
+                   for item in range(0, 7)]
+        pks = [models.HashTestModel.objects.create(
+            record=text_type(item), md5=digest).pk
+            for item, digest in enumerate(digests)]
+        index = HashIndex(models.HashTestModel, 'md5')
+        index.chunk_size = 2
+        index.load()
+        self.assertEqual(
+            bytes(index.digests),
+            b''.join(sorted(bytes.fromhex(digest) for digest in digests)))
+        self.assertEqual(
+            [index.get(digest) for digest in digests], pks)
+
+    def test_unchanged(self):
+        dics = [{'record': text_type(item), 'zahl': 'alfred'}
+                for item in range(0, 3)]
+        self.HashGenerator(models.HashTestModel).get_instances(dics)
+        generator = self.HashGenerator(
+            models.HashTestModel, options={'hash_index': True})
+        generator.get_instance(dics[0])
+        self.assertEqual(generator.res, GenerationStatus.Exists)
+        # one query fetching the unchanged records by primary key
+        with self.assertNumQueries(1):
+            res = generator.get_instances(dics)
+        self.assertEqual(
+            [item[1] for item in res], [GenerationStatus.Exists] * 3)
+        self.assertEqual(
+            [item[0].pk for item in res],
+            [models.HashTestModel.objects.get(record=dic['record']).pk
+             for dic in dics])
+        generator.get_instance({'record': '0', 'zahl': 'britta'})
+        self.assertEqual(generator.res, GenerationStatus.Updated)
+        with self.assertNumQueries(1):
+            instance = generator.get_instance(
+                {'record': '0', 'zahl': 'britta'})
+        self.assertEqual(generator.res, GenerationStatus.Exists)
+        # fetched from the database
+        self.assertEqual(instance._state.db, 'default')
+        res = generator.get_instances([dics[0]])
+        self.assertEqual(res[0][1], GenerationStatus.Updated)
+
+    def test_rollback(self):
+        generator = self.HashGenerator(
+            models.HashTestModel, options={'hash_index': True})
+        dic = {'record': '1', 'zahl': 'alfred'}
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                generator.get_instance(dict(dic))
+                self.assertEqual(generator.res, GenerationStatus.Created)
+                raise IntegrityError
+        generator.rollback()
+        generator.get_instance(dict(dic))
+        self.assertEqual(generator.res, GenerationStatus.Created)
+        generator.commit()
+        generator.get_instance(dict(dic))
+        self.assertEqual(generator.res, GenerationStatus.Exists)
+
+
+class TestBatchGeneration(TestCase):
+
+    def test_get_instances(self):
+        generator = InstanceGenerator(models.TestModel)
+        res = generator.get_instances([
+            {'record': '1', 'numero': 'uno'},
+            {'record': '2', 'numero': 'due', 'related': [
+                {'record': '10', 'ilosc': 'dziesiec'}]},
+            {'record': '1', 'name': 'again', 'numero': 'uno'},
+            {'record': '3', 'date': '3333', 'numero': 'uno'}])
+        self.assertEqual(
+            [item[1] for item in res[0:3]],
+            [GenerationStatus.Created, GenerationStatus.Created,
+             GenerationStatus.Updated])
+        self.assertIsInstance(res[3][1], ValidationError)
+        self.assertIs(res[0][0], res[2][0])
+        self.assertEqual(models.TestModel.objects.count(), 2)
+        self.assertEqual(
+            models.TestModel.objects.get(record='1').name, 'again')
+        self.assertEqual(
+            models.TestModel.objects.get(record='2').related.count(), 1)
+        res = generator.get_instances([
+            {'record': '1', 'name': 'once more', 'numero': 'uno'}])
+        self.assertEqual(res[0][1], GenerationStatus.Updated)
+        self.assertEqual(
+            models.TestModel.objects.get(record='1').name, 'once more')
+
+
+class TestColumns(TestCase):
+
+    def test_coerce(self):
+        generator = InstanceGenerator(models.WellDefinedModel)
+        field = models.WellDefinedModel._meta.get_field('somenumber')
+        self.assertEqual(
+            generator.coerce_integers(field, ['1', ' 2', 'x', '', None]),
+            ([1, 2, None, None, None], [2]))
+        values, invalid = generator.coerce_integers(field, ['1', 2])
+        self.assertEqual((values, invalid), ([1, 2], []))
+        self.assertIs(type(values[0]), int)
+        self.assertEqual(
+            generator.coerce_floats(field, ['1.5', 2, 'nan', 'x'])[1], [3])
+        self.assertEqual(
+            generator.coerce_texts(CharField(max_length=3), ['abcd', 5, None]),
+            (['abc', '5', None], []))
+        self.assertEqual(
+            generator.coerce_booleans(field, ['t', 'f', 1, 0, None])[0],
+            [True, False, True, False, False])
+
+    def test_prepare_columns(self):
+        generator = InstanceGenerator(models.WellDefinedModel)
+        coerced, errors = generator.prepare_columns([
+            {'something': 'thing', 'somenumber': '1'},
+            {'something': 5, 'somenumber': 'x'},
+            {'somenumber': '3'}])
+        self.assertEqual(coerced, [
+            {'something': 'thing', 'somenumber': 1},
+            {'something': '5', 'somenumber': None},
+            {'somenumber': 3}])
+        self.assertIsNone(errors[0])
+        self.assertIn('somenumber', errors[1].message_dict)
+
+    def test_reject_invalid(self):
+        generator = InstanceGenerator(
+            models.WellDefinedModel, options={'reject_invalid': True})
+        res = generator.get_instances([
+            {'something': 'thing', 'somenumber': '1'},
+            {'something': 'thing', 'somenumber': 'x'}])
+        self.assertEqual(res[0][1], GenerationStatus.Created)
+        self.assertEqual(res[0][0].somenumber, 1)
+        self.assertIsInstance(res[1][1], ValidationError)
+
+    def test_override(self):
+
+        class Generator(InstanceGenerator):
+
+            def prepare_integer(self, field, value):
+                return int(value) * 2
+
+        generator = Generator(models.WellDefinedModel)
+        self.assertNotIn('somenumber', generator.column_plan)
+        self.assertIn('something', generator.column_plan)
+
+
+UPSERT = getattr(
+    connection.features, 'supports_update_conflicts_with_target', False)
+
+
+class TestUpsert(TestCase):
+
+    def test_upsert_fields(self):
+        generator = InstanceGenerator(
+            models.TestModel, persistence='record', options={'upsert': True})
+        rows = [BatchRow('record', True, True)]
+        supported = getattr(
+            connection.features, 'supports_update_conflicts_with_target',
+            False)
+        self.assertEqual(
+            generator.get_upsert_fields(rows),
+            ['record'] if supported else None)
+        rows.append(BatchRow('name', True, True))
+        self.assertIsNone(generator.get_upsert_fields(rows))
+        generator.upsert = False
+        self.assertIsNone(generator.get_upsert_fields(rows[0:1]))
+        generator = InstanceGenerator(
+            models.WellDefinedModel, options={'upsert': True})
+        rows = [BatchRow([('something', 'somenumber')], True, True)]
+        self.assertEqual(
+            generator.get_upsert_fields(rows),
+            ['something', 'somenumber'] if supported else None)
+
+    @skipUnless(UPSERT, 'requires Django 4.1 and a backend with upserts')
+    def test_upsert(self):
+        models.TestModel.objects.create(
+            record='1', name='old', numero=models.Numero.objects.create(
+                name='uno'))
+        generator = InstanceGenerator(
+            models.TestModel, persistence='record', options={'upsert': True})
+        with CaptureQueriesContext(connection) as queries:
+            res = generator.get_instances([
+                {'record': '1', 'name': 'new', 'numero': 'uno'},
+                {'record': '2', 'name': 'other', 'numero': 'uno'}])
+        upserts = [
+            query['sql'] for query in queries.captured_queries
+            if 'ON CONFLICT' in query['sql'].upper() or
+            'ON DUPLICATE KEY' in query['sql'].upper()]
+        self.assertEqual(len(upserts), 1)
+        self.assertEqual(
+            [item[1] for item in res],
+            [GenerationStatus.Updated, GenerationStatus.Created])
+        self.assertEqual(models.TestModel.objects.count(), 2)
+        self.assertEqual(
+            models.TestModel.objects.get(record='1').name, 'new')
+        instance = models.TestModel.objects.get(record='2')
+        self.assertEqual(instance.name, 'other')
+        self.assertEqual(res[1][0].pk, instance.pk)
+
+    @skipUnless(UPSERT, 'requires Django 4.1 and a backend with upserts')
+    def test_upsert_without_update_fields(self):
+        # the unique name is the only field besides the primary key
+        models.Numero.objects.create(name='a')
+        generator = InstanceGenerator(
+            models.Numero, options={'upsert': True})
+        res = generator.get_instances([{'name': 'a'}, {'name': 'b'}])
+        self.assertEqual(res[1][1], GenerationStatus.Created)
+        self.assertEqual(
+            res[1][0].pk, models.Numero.objects.get(name='b').pk)
+        self.assertEqual(models.Numero.objects.count(), 2)
+
+    def test_fetch_pks(self):
+        numero = models.Numero.objects.create(name='uno')
+        pks = [models.TestModel.objects.create(
+            record=record, numero=numero).pk for record in ['1', '2']]
+        instances = [models.TestModel(record=record, numero=numero)
+                     for record in ['2', '1', '3']]
+        InstanceGenerator(models.TestModel).fetch_pks(instances, ['record'])
+        self.assertEqual(
+            [instance.pk for instance in instances], [pks[1], pks[0], None])
+        self.assertFalse(instances[0]._state.adding)
+
+
+class TestPersistenceIndex(TestCase):
+
+    def test_index(self):
+        for item in range(0, 3):
+            models.WellDefinedModel.objects.create(
+                something='thing', somenumber=item)
+        generator = InstanceGenerator(models.WellDefinedModel)
+        dics = [{'something': 'thing', 'somenumber': item}
+                for item in range(0, 5)]
+        index = PersistenceIndex(generator)
+        with self.assertNumQueries(1):
+            index.load((dic, generator.persistence) for dic in dics)
+        generator.persistence_index = index
+        with self.assertNumQueries(0):
+            res = [generator.get_from_db(dic, generator.persistence)
+                   for dic in dics]
+        self.assertEqual([len(item) for item in res], [1, 1, 1, 0, 0])
+        self.assertEqual(res[2][0].somenumber, 2)
+
+    def test_index_with_foreign_key(self):
+        numero = models.Numero.objects.create(name='uno')
+        another = models.AnotherModel.objects.create(record='1')
+        models.TwoRelatedAsUnique.objects.create(
+            numero=numero, another=another, value='a')
+        generator = InstanceGenerator(models.TwoRelatedAsUnique)
+        dic = {'numero': numero, 'another': another}
+        index = PersistenceIndex(generator)
+        index.load([(dic, generator.persistence)])
+        self.assertEqual(index.get(dic, generator.persistence)[0].value, 'a')
+
+    def test_hashed_batch(self):
+
+        class HashGenerator(HashMixin, InstanceGenerator):
+            pass
+
+        generator = HashGenerator(models.HashTestModel)
+        generator.get_instances([{'record': '1', 'zahl': 'alfred'}])
+        res = generator.get_instances([
+            {'record': '1', 'zahl': 'alfred'},
+            {'record': '2', 'zahl': 'britta'}])
+        self.assertEqual(
+            [item[1] for item in res],
+            [GenerationStatus.Exists, GenerationStatus.Created])
+
+
+class TestRelatedCache(TestCase):
+
+    def test_lru(self):
+        cache = RelatedCache(maxsize=2)
+        one = models.Numero.objects.create(name='one')
+        two = models.Numero.objects.create(name='two')
+        cache.set('one', one)
+        cache.set('two', two)
+        self.assertIs(cache.get('one'), one)
+        cache.set('three', two)
+        self.assertIsNone(cache.get('two'))
+        self.assertIs(cache.get('one'), one)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_fk_resolution(self):
+        cache = RelatedCache()
+        generator = InstanceGenerator(
+            models.TestModel, options={'related_cache': cache})
+        for item in range(0, 3):
+            generator.get_instance({'record': item, 'numero': 'uno'})
+        self.assertEqual(models.Numero.objects.count(), 1)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_invalidation(self):
+        cache = RelatedCache()
+        generator = InstanceGenerator(
+            models.TestModel, options={'related_cache': cache})
+        first = {'rec': '1', 'name': 'first'}
+        second = {'rec': '1', 'name': 'second'}
+        for item, elnumero in enumerate([first, second, first]):
+            instance = generator.get_instance({
+                'record': item, 'numero': 'uno', 'elnumero': elnumero})
+        self.assertEqual(instance.elnumero.name, 'first')
+        self.assertEqual(models.ElNumero.objects.get().name, 'first')
+
+
+class TestGeneratorRegistry(TestCase):
+
+    def test_registry(self):
+        generator = InstanceGenerator(models.TestModel)
+        numero = generator.get_generator(models.Numero)
+        self.assertIs(generator.get_generator(models.Numero), numero)
+        self.assertIs(numero.generators, generator.generators)
+        self.assertIsNot(
+            generator.get_generator(models.Numero, {'related_field': 'pk'}),
+            numero)
+        for item in range(0, 3):
+            generator.get_instance({
+                'record': item, 'numero': 'uno', 'related': [
+                    {'record': item, 'ilosc': 'jeden'}]})
+        self.assertEqual(len(generator.generators), 4)
+        self.assertEqual(models.Polish.objects.count(), 3)
+        self.assertEqual(
+            models.TestModel.objects.get(record='2').related.count(), 1)
+
+
+class TestBatchRelations(TestCase):
+
+    def test_update_links(self):
+        generator = InstanceGenerator(models.TestModel)
+        dics = [{'record': item, 'numero': 'uno', 'related': [
+            {'record': '1', 'ilosc': 'jeden'},
+            {'record': '2', 'ilosc': 'dwa'}]} for item in range(0, 3)]
+        generator.get_instances(dics[0:1])
+        self.assertEqual(models.TestModel.related.through.objects.count(), 2)
+        links = [(instance, list(models.Polish.objects.all()))
+                 for instance in models.TestModel.objects.all()]
+        with self.assertNumQueries(1):
+            generator.update_links('related', links)
+        generator.get_instances(dics)
+        self.assertEqual(models.TestModel.related.through.objects.count(), 6)
+
+    def test_remove_related(self):
+        generator = InstanceGenerator(
+            models.TestModel, options={'remove_related': True})
+        generator.get_instance({'record': '1', 'numero': 'uno', 'related': [
+            {'record': '1', 'ilosc': 'jeden'},
+            {'record': '2', 'ilosc': 'dwa'}]})
+        generator.get_instances([{'record': '1', 'numero': 'uno', 'related': [
+            {'record': '2', 'ilosc': 'dwa'},
+            {'record': '3', 'ilosc': 'trzy'}]}])
+        instance = models.TestModel.objects.get()
+        self.assertEqual(
+            sorted(instance.related.values_list('record', flat=True)),
+            ['2', '3'])
+        generator.get_instance({'record': '1', 'numero': 'uno', 'related': []})
+        self.assertEqual(instance.related.count(), 0)
+
+    def test_m2m_changed(self):
+        actions = []
+
+        def receiver(sender, action, **kwargs):
+            actions.append(action)
+
+        m2m_changed.connect(
+            receiver, sender=models.TestModel.related.through)
+        try:
+            generator = InstanceGenerator(
+                models.TestModel, options={'remove_related': True})
+            generator.get_instance({
+                'record': '1', 'numero': 'uno',
+                'related': [{'record': '1', 'ilosc': 'jeden'}]})
+            self.assertEqual(actions, ['pre_add', 'post_add'])
+            del actions[:]
+            generator.get_instance({
+                'record': '1', 'numero': 'uno',
+                'related': [{'record': '2', 'ilosc': 'dwa'}]})
+            self.assertEqual(
+                actions, ['pre_remove', 'post_remove', 'pre_add', 'post_add'])
+            del actions[:]
+            # batches are linked without signals
+            generator.get_instances([{'record': '2', 'numero': 'uno',
+                                      'related': [{'record': '2'}]}])
+            self.assertEqual(actions, [])
+        finally:
+            m2m_changed.disconnect(
+                receiver, sender=models.TestModel.related.through)
+
+    def test_rejected_row_savepoint(self):
+        cache = RelatedCache()
+        generator = InstanceGenerator(
+            models.TestModel, options={'related_cache': cache})
+        res = generator.get_instances([
+            {'record': '1', 'numero': 'fresh', 'date': '3333'},
+            {'record': '2', 'numero': 'uno'}])
+        self.assertIsInstance(res[0][1], ValidationError)
+        self.assertEqual(res[1][1], GenerationStatus.Created)
+        # the related record created for the rejected row is rolled back
+        self.assertFalse(models.Numero.objects.filter(name='fresh').exists())
+        self.assertEqual(len(cache.entries), 1)
+        res = generator.get_instances([{'record': '3', 'numero': 'fresh'}])
+        self.assertEqual(res[0][0].numero.name, 'fresh')
+        self.assertTrue(models.Numero.objects.filter(name='fresh').exists())
+
+    def test_back_refs(self):
+        generator = InstanceGenerator(models.Numero)
+        res = generator.get_instances([
+            {'name': 'uno', 'testmodel': [
+                {'record': '1', 'name': 'one'},
+                {'record': '2', 'name': 'two'}]},
+            {'name': 'due', 'testmodel': {'record': '3', 'name': 'three'}}])
+        self.assertEqual(
+            [item[1] for item in res],
+            [GenerationStatus.Created, GenerationStatus.Created])
+        self.assertEqual(res[0][0].testmodel_set.count(), 2)
+        self.assertEqual(
+            models.TestModel.objects.get(record='3').numero.name, 'due')
+        with self.assertRaises(ValidationError):
+            generator.get_instances([{'name': 'tre', 'testmodel': [
+                {'record': '4', 'date': '3333'}]}])
+
+    def test_custom_through(self):
+        generator = InstanceGenerator(models.SomeModel)
+        generator.get_instances([{'record': '1', 'lnames': [
+            {'record': '1:1', 'last_name': 'Doe'},
+            {'record': '1:2', 'last_name': 'Carvello'}]}])
+        instance = models.SomeModel.objects.get()
+        self.assertEqual(instance.lnames.count(), 2)
+
+
 class TestSelectRelatedByRelated(TestCase):
     """
     This test was created because of a bug that a record
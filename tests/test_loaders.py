@@ -1,17 +1,28 @@
 from __future__ import print_function
 
+import bz2
 import csv
 import glob
+import gzip
+import lzma
 import os
 import re
-from unittest import skip
+import shutil
+import subprocess
+from unittest import skip, skipUnless
 
+from django.db import connection
 from django.test import TestCase, TransactionTestCase
 from six import StringIO, text_type
 
-from etl_sync.loaders import Extractor, Loader
+import tempfile
+
+from etl_sync.loaders import (
+    Checkpoint, Extractor, Loader, OffsetIndex, ParallelLoader, Sweeper,
+    ThreadedLoader)
+from etl_sync.logging import Counter
 from etl_sync.transformations import Transformer
-from .models import ElNumero, TestModel
+from .models import ElNumero, Numero, TestModel
 from .utils import captured_output
 
 
@@ -147,6 +158,19 @@ class TestHeaderlessLoad(TransactionTestCase):
         loader.load()
         self.assertEqual(model.objects.count(), 3)
 
+    def test_transformer_per_row(self):
+        # subclasses may read the row in __init__
+        class RowTransformer(Transformer):
+
+            def __init__(self, dic, defaults=None):
+                super(RowTransformer, self).__init__(dic, defaults)
+                self.rec = dic['rec']
+
+        loader = Loader(self.filename, model_class=ElNumero)
+        loader.transformer_class = RowTransformer
+        for rec in ['1', '2']:
+            self.assertEqual(loader.transform({'rec': rec})[0], {'rec': rec})
+
 
 class TestExtractor(TestCase):
     """Test newly introduced ExtractorClass."""
@@ -178,6 +202,67 @@ class TestExtractor(TestCase):
             ct = 0
 
 
+class TestCompressedExtractor(TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        with open(os.path.join(
+                os.path.dirname(os.path.realpath(__file__)),
+                'data.txt'), 'rb') as fil:
+            self.content = fil.read()
+        self.filenames = {}
+        for name, module in [('gzip', gzip), ('bz2', bz2), ('xz', lzma)]:
+            # no extension, detected by the magic bytes
+            filename = os.path.join(self.dirname, name)
+            with module.open(filename, 'wb') as fil:
+                fil.write(self.content)
+            self.filenames[name] = filename
+
+    def tearDown(self):
+        for fil in glob.glob(os.path.join(self.dirname, '*')):
+            os.remove(fil)
+        os.rmdir(self.dirname)
+
+    def read(self, filename, options=None):
+        extractor = Extractor(filename, options=options)
+        with extractor as ex:
+            return extractor, [item['record'] for item in ex]
+
+    def test_compressions(self):
+        for name, filename in self.filenames.items():
+            extractor, records = self.read(filename)
+            self.assertEqual(extractor.get_compression(), name)
+            self.assertFalse(extractor.can_seek())
+            self.assertEqual(records, ['1', '2', '3'])
+        extractor = Extractor(self.filenames['gzip'], options={
+            'compression': False})
+        self.assertIsNone(extractor.get_compression())
+
+    @skipUnless(shutil.which('xz'), 'requires xz')
+    def test_decompress_threads(self):
+        extractor, records = self.read(
+            self.filenames['xz'], options={'decompress_threads': True})
+        self.assertEqual(records, ['1', '2', '3'])
+        self.assertIsNone(extractor.process)
+
+    @skipUnless(shutil.which('zstd'), 'requires zstd')
+    def test_zstd(self):
+        filename = os.path.join(self.dirname, 'data.txt.zst')
+        subprocess.check_output(
+            ['zstd', '-q', '-o', filename, '-'], input=self.content)
+        self.assertEqual(self.read(filename, options={
+            'decompress_threads': True})[1], ['1', '2', '3'])
+
+    def test_load(self):
+        options = {'slice_begin': 2, 'offset_index': True,
+                   'checkpoint': True}
+        counter = Loader(
+            self.filenames['gzip'], model_class=TestModel,
+            options=options).load()
+        self.assertEqual(counter.created, 2)
+        self.assertFalse(os.path.exists(self.filenames['gzip'] + '.idx'))
+
+
 class TestFileLikeObjectInLoader(TestCase):
 
     def setUp(self):
@@ -202,3 +287,352 @@ class TestOptionPassing(TestCase):
         ldr = Loader('test', model_class=TestModel, options=options)
         self.assertEqual(ldr.extractor.options, options)
         self.assertFalse(ldr.generator.create)
+
+
+class TestBatchLoad(TestCase):
+
+    def setUp(self):
+        self.filename = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), 'data.txt')
+
+    def test_batch_load(self):
+        options = {'batch_size': 2}
+        counter = Loader(
+            self.filename, model_class=TestModel, options=options).load()
+        self.assertEqual(TestModel.objects.count(), 3)
+        self.assertEqual(counter.created, 3)
+        counter = Loader(
+            self.filename, model_class=TestModel, options=options).load()
+        self.assertEqual(TestModel.objects.count(), 3)
+        self.assertEqual(counter.updated, 3)
+
+    def test_batch_slice(self):
+        options = {'batch_size': 2, 'slice_begin': 2, 'slice_end': 2}
+        Loader(self.filename, model_class=TestModel, options=options).load()
+        self.assertEqual(
+            list(TestModel.objects.values_list('record', flat=True)), ['2'])
+
+
+class TestRollback(TestCase):
+    """
+    Records created for rejected rows must not remain in the caches.
+    """
+
+    def load(self, content, options):
+        return Loader(
+            StringIO(content), model_class=TestModel, options=dict(
+                options, related_cache_size=100)).load()
+
+    def test_write(self):
+        counter = self.load(
+            'record\tnumero\tdate\n1\tuno\tbad\n2\tuno\t2015-01-01\n',
+            {})
+        self.assertEqual((counter.created, counter.rejected), (1, 1))
+        self.assertEqual(
+            TestModel.objects.get().numero.name, 'uno')
+
+    def test_write_batch(self):
+        counter = self.load(
+            'record\tname\tnumero\n1\tone\tuno\n2\ttwo\tuno\n'
+            '3\tthree\t\n', {'batch_size': 10})
+        self.assertEqual((counter.created, counter.rejected), (2, 1))
+        self.assertEqual(Numero.objects.count(), 1)
+
+
+class TestSweep(TestCase):
+
+    def setUp(self):
+        self.filename = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), 'data.txt')
+        numero = Numero.objects.create(name='uno')
+        for record in ['1', '8', '9']:
+            TestModel.objects.create(record=record, numero=numero)
+
+    def load(self, options):
+        with captured_output() as (out, err):
+            counter = Loader(
+                self.filename, model_class=TestModel, options=options).load()
+        return counter, out.getvalue()
+
+    def test_sweep(self):
+        counter, out = self.load({'sweep': True, 'batch_size': 2})
+        self.assertEqual(counter.removed, 2)
+        self.assertIn('2 removed', out)
+        self.assertEqual(
+            sorted(TestModel.objects.values_list('record', flat=True)),
+            ['1', '2', '3'])
+
+    def test_soft_delete(self):
+        options = {'sweep': True, 'sweep_filter': {'record': '9'},
+                   'sweep_update': {'name': 'deleted'}}
+        counter, _ = self.load(options)
+        self.assertEqual(counter.removed, 1)
+        self.assertEqual(TestModel.objects.count(), 5)
+        self.assertEqual(
+            list(TestModel.objects.filter(name='deleted').values_list(
+                'record', flat=True)), ['9'])
+
+    def test_chunks(self):
+        sweeper = Sweeper(TestModel, update={'name': 'deleted'})
+        sweeper.chunk_size = 1
+        sweeper.start()
+        pk = TestModel.objects.get(record='8').pk
+        with self.assertNumQueries(1):
+            # written to the temporary table once chunk_size is reached
+            sweeper.add(pk)
+        sweeper.add(pk)
+        self.assertEqual(sweeper.sweep(), 2)
+        self.assertEqual(
+            sorted(TestModel.objects.filter(name='deleted').values_list(
+                'record', flat=True)), ['1', '9'])
+
+    def test_parallel(self):
+        with self.assertRaises(ValueError):
+            ParallelLoader(self.filename, model_class=TestModel,
+                           options={'sweep': True, 'workers': 2})
+
+    def test_skip(self):
+        counter, out = self.load({'sweep': True, 'slice_end': 2})
+        self.assertEqual(counter.removed, 0)
+        self.assertIn('Sweep skipped', out)
+        self.assertEqual(TestModel.objects.count(), 4)
+
+
+class TestParallelLoader(TestCase):
+
+    def setUp(self):
+        self.filename = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), 'data.txt')
+
+    def test_slices(self):
+        loader = ParallelLoader(
+            self.filename, model_class=TestModel, options={'workers': 3})
+        self.assertEqual(loader.count(), 3)
+        self.assertEqual(loader.get_slices(10), [(1, 4), (5, 8), (9, 10)])
+        self.assertEqual(loader.get_slices(2), [(1, 1), (2, 2)])
+        loader = ParallelLoader(self.filename, model_class=TestModel,
+                                options={'workers': 2, 'slice_begin': 3,
+                                         'slice_end': 6})
+        self.assertEqual(loader.get_slices(10), [(3, 4), (5, 6)])
+
+    def test_merge_counters(self):
+        counter, other = Counter(), Counter()
+        counter.create()
+        other.pos = 10
+        other.update()
+        other.reject()
+        counter.merge(other)
+        self.assertEqual(
+            (counter.pos, counter.created, counter.updated, counter.rejected),
+            (12, 1, 1, 1))
+
+    def test_single_worker(self):
+        loader = ParallelLoader(
+            self.filename, model_class=TestModel, options={'workers': 1})
+        self.assertEqual(loader.load().created, 3)
+
+
+class TestParallelWorkers(TransactionTestCase):
+
+    def setUp(self):
+        if (connection.vendor == 'sqlite' and
+                'memory' in connection.settings_dict['NAME']):
+            self.skipTest('worker processes need a test database on disk')
+
+    def test_two_workers(self):
+        # created up front, the workers would race to create them
+        Numero.objects.create(name='uno')
+        Numero.objects.create(name='due')
+        loader = ParallelLoader(
+            os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                         'data.txt'),
+            model_class=TestModel, options={'workers': 2})
+        self.assertEqual(len(loader.get_slices(loader.count())), 2)
+        counter = loader.load()
+        self.assertEqual((counter.created, counter.rejected), (3, 0))
+        self.assertEqual(
+            sorted(TestModel.objects.values_list('record', flat=True)),
+            ['1', '2', '3'])
+
+
+class TestOffsetIndex(TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dirname, 'data.csv')
+        with open(self.filename, 'w') as fil:
+            fil.write(
+                'record,name,numero\r\n1,one,uno\r\n\r\n'
+                '2,"two\nlines",uno\r\n3,three,uno')
+
+    def tearDown(self):
+        for fil in glob.glob(os.path.join(self.dirname, '*')):
+            os.remove(fil)
+        os.rmdir(self.dirname)
+
+    def test_index(self):
+        index = OffsetIndex(self.filename)
+        self.assertEqual(list(index.load()), [20, 33, 52])
+        self.assertTrue(os.path.exists(self.filename + '.idx'))
+        self.assertEqual(list(OffsetIndex(self.filename).load()), [20, 33, 52])
+        index = OffsetIndex(self.filename, quoting=csv.QUOTE_NONE)
+        self.assertEqual(len(index.build()), 4)
+
+    def test_seek(self):
+
+        class CSVLoader(Loader):
+            reader_kwargs = {'delimiter': ','}
+
+        options = {'slice_begin': 2, 'slice_end': 2, 'offset_index': True}
+        counter = CSVLoader(
+            self.filename, model_class=TestModel, options=options).load()
+        self.assertEqual(counter.created, 1)
+        self.assertEqual(TestModel.objects.get().name, 'two\nlines')
+
+
+class TestCheckpoint(TestCase):
+
+    class CSVLoader(Loader):
+        reader_kwargs = {'delimiter': ','}
+
+    class FailingLoader(CSVLoader):
+
+        def write(self, dic):
+            if dic['record'] == '3':
+                raise RuntimeError('connection lost')
+            return super(TestCheckpoint.FailingLoader, self).write(dic)
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dirname, 'data.csv')
+        self.checkpoint = os.path.join(self.dirname, 'checkpoint')
+        with open(self.filename, 'w') as fil:
+            fil.write(
+                'record,name,numero\r\n1,one,uno\r\n\r\n'
+                '2,"two\nlines",uno\r\n3,three,uno')
+
+    def tearDown(self):
+        for fil in glob.glob(os.path.join(self.dirname, '*')):
+            os.remove(fil)
+        os.rmdir(self.dirname)
+
+    def test_resume(self):
+        options = {'checkpoint': self.checkpoint, 'checkpoint_interval': 1,
+                   'offset_index': True, 'batch_size': 2}
+        with captured_output():
+            with self.assertRaises(RuntimeError):
+                self.FailingLoader(
+                    self.filename, model_class=TestModel,
+                    options=dict(options, batch_size=None)).load()
+        state = Checkpoint(self.checkpoint, source=self.filename).load()
+        self.assertEqual(
+            (state['pos'], state['offset'], state['created']), (3, 52, 2))
+        TestModel.objects.filter(record='1').delete()
+        with captured_output() as (out, err):
+            counter = self.CSVLoader(
+                self.filename, model_class=TestModel,
+                options=dict(options, resume=True)).load()
+        self.assertIn('Resuming at row 3', out.getvalue())
+        self.assertEqual((counter.pos, counter.created), (4, 3))
+        self.assertEqual(
+            sorted(TestModel.objects.values_list('record', flat=True)),
+            ['2', '3'])
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_threaded(self):
+
+        class FailingThreadedLoader(ThreadedLoader):
+            reader_kwargs = {'delimiter': ','}
+
+            def write(self, dic):
+                if dic['record'] == '3':
+                    raise RuntimeError('connection lost')
+                return super(FailingThreadedLoader, self).write(dic)
+
+        options = {'checkpoint': self.checkpoint, 'checkpoint_interval': 1}
+        with captured_output():
+            with self.assertRaises(RuntimeError):
+                FailingThreadedLoader(
+                    self.filename, model_class=TestModel,
+                    options=options).load()
+        state = Checkpoint(self.checkpoint, source=self.filename).load()
+        self.assertEqual((state['pos'], state['created']), (3, 2))
+
+    def test_parallel(self):
+        for name in ['checkpoint', 'resume']:
+            with self.assertRaises(ValueError):
+                ParallelLoader(self.filename, model_class=TestModel,
+                               options={name: True, 'workers': 2})
+
+    def test_changed_source(self):
+        checkpoint = Checkpoint(self.checkpoint, source=self.filename)
+        checkpoint.save(Counter())
+        self.assertEqual(checkpoint.load()['pos'], 1)
+        with open(self.filename, 'a') as fil:
+            fil.write('\r\n4,four,uno')
+        self.assertIsNone(checkpoint.load())
+
+
+class TestPruneFields(TestCase):
+
+    class MappingTransformer(Transformer):
+        mappings = {'name': 'NAME', 'numero': {'name': 'NUMERO'}}
+
+    class FieldsReader(object):
+        accepts_fields = True
+
+    def test_source_fields(self):
+
+        class PruningLoader(Loader):
+            transformer_class = self.MappingTransformer
+            reader_class = self.FieldsReader
+            reader_kwargs = {'delimiter': ',', 'fields': ['extra']}
+
+        loader = PruningLoader(
+            'data.csv', model_class=TestModel,
+            options={'prune_fields': True})
+        fields = loader.extractor.reader_kwargs['fields']
+        for name in ['NAME', 'NUMERO', 'extra', 'record', 'numero_id']:
+            self.assertIn(name, fields)
+        self.assertEqual(PruningLoader.reader_kwargs['fields'], ['extra'])
+        loader = PruningLoader('data.csv', model_class=TestModel)
+        self.assertEqual(loader.extractor.reader_kwargs['fields'], ['extra'])
+
+    def test_unsupported_reader(self):
+        with self.assertRaises(ValueError):
+            Loader('data.csv', model_class=TestModel,
+                   options={'prune_fields': True})
+
+
+class TestThreadedLoader(TestCase):
+
+    def setUp(self):
+        self.filename = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), 'data.txt')
+
+    def test_load(self):
+        options = {'transform_workers': 2, 'queue_size': 1}
+        counter = ThreadedLoader(
+            self.filename, model_class=TestModel, options=options).load()
+        self.assertEqual(counter.created, 3)
+        options['batch_size'] = 2
+        counter = ThreadedLoader(
+            self.filename, model_class=TestModel, options=options).load()
+        self.assertEqual(counter.updated, 3)
+
+    def test_rejection_order(self):
+
+        class RejectingTransformer(Transformer):
+            blacklist = {'record': [r'^2$']}
+
+        class RejectingLoader(ThreadedLoader):
+            transformer_class = RejectingTransformer
+
+        with captured_output() as (out, err):
+            counter = RejectingLoader(
+                self.filename, model_class=TestModel,
+                options={'slice_end': 2}).load()
+        self.assertEqual((counter.created, counter.rejected), (1, 1))
+        self.assertIn('not allowed in field record', out.getvalue())
+        self.assertEqual(
+            list(TestModel.objects.values_list('record', flat=True)), ['1'])
@@ -0,0 +1,95 @@
+from __future__ import absolute_import
+
+from types import SimpleNamespace
+from unittest import skipUnless
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.exceptions import ValidationError
+from django.db import connection, models as django_models
+from django.test import TestCase
+
+from etl_sync.generators import BatchRow
+from etl_sync.postgres import CopyGenerator
+from etl_sync.types import GenerationStatus
+from tests import models
+
+
+# Point DATABASES in settings_local.py to a throwaway PostgreSQL
+# (PostGIS) database to run the COPY tests.
+POSTGRES = connection.vendor == 'postgresql'
+
+
+class TestCopyGenerator(TestCase):
+
+    def setUp(self):
+        models.TestModel.objects.create(
+            record='1', name='old', numero=models.Numero.objects.create(
+                name='uno'))
+
+    def load(self):
+        generator = CopyGenerator(models.TestModel, persistence='record')
+        res = generator.get_instances([
+            {'record': '1', 'name': 'new', 'numero': 'uno'},
+            {'record': '2', 'name': 'other', 'numero': 'uno',
+             'related': [{'record': '10', 'ilosc': 'dziesiec'}]},
+            {'record': '2', 'name': 'again', 'numero': 'uno'},
+            {'record': '3', 'date': '3333', 'numero': 'uno'}])
+        self.assertEqual(
+            [item[1] for item in res[0:3]],
+            [GenerationStatus.Updated, GenerationStatus.Created,
+             GenerationStatus.Updated])
+        self.assertIsInstance(res[3][1], ValidationError)
+        self.assertIs(res[1][0], res[2][0])
+        self.assertEqual(models.TestModel.objects.count(), 2)
+        self.assertEqual(
+            models.TestModel.objects.get(record='1').name, 'new')
+        instance = models.TestModel.objects.get(record='2')
+        self.assertEqual(res[1][0].pk, instance.pk)
+        self.assertEqual(instance.name, 'again')
+        self.assertEqual(instance.related.count(), 1)
+
+    def test_can_copy(self):
+        generator = CopyGenerator(models.TestModel, persistence='record')
+        rows = [BatchRow('record', True, True)]
+        self.assertEqual(
+            generator.can_copy(rows), ['record'] if POSTGRES else None)
+        rows.append(BatchRow('record', True, False))
+        self.assertIsNone(generator.can_copy(rows))
+
+    def test_format_value(self):
+        generator = CopyGenerator(models.TestModel)
+        self.assertEqual(generator.format_value(None), '')
+        self.assertEqual(generator.format_value(''), '""')
+        self.assertEqual(generator.format_value('a "b"'), '"a ""b"""')
+        self.assertEqual(generator.format_value(True), '"t"')
+        self.assertEqual(generator.format_value(b'\x01'), '"\\x01"')
+        self.assertEqual(
+            generator.format_value(['a', None, 'b "c"', ['d\\']]),
+            '"{""a"",NULL,""b \\""c\\"""",{""d\\\\""}}"')
+
+    def test_copy_geometry(self):
+        generator = CopyGenerator(models.GeometryModel)
+        field = models.GeometryModel._meta.get_field('geom2d')
+        instance = models.GeometryModel(geom2d=GEOSGeometry('POINT (1 2)'))
+        # e.g. changed after assignment, which sets the SRID of the field
+        instance.geom2d.srid = None
+        value = generator.get_copy_value(field, instance, connection)
+        self.assertEqual(GEOSGeometry(value.strip('"')).srid, field.srid)
+        self.assertIsNone(instance.geom2d.srid)
+
+    @skipUnless(hasattr(django_models, 'JSONField'), 'requires Django 3.1')
+    def test_copy_json(self):
+        generator = CopyGenerator(models.TestModel)
+        field = django_models.JSONField()
+        field.set_attributes_from_name('data')
+        instance = SimpleNamespace(data={'a': [1, 'b']})
+        self.assertEqual(
+            generator.get_copy_value(field, instance, connection),
+            '"{""a"": [1, ""b""]}"')
+
+    def test_fallback(self):
+        self.load()
+
+    @skipUnless(POSTGRES, 'requires PostgreSQL')
+    def test_copy(self):
+        self.load()
@@ -4,8 +4,11 @@ from six import text_type
 from future.utils import iteritems
 
 import os
+import tempfile
+from datetime import datetime
 from unittest import TestCase
-from etl_sync.readers import unicode_dic, OGRReader
+from osgeo import ogr, osr
+from etl_sync.readers import unicode_dic, OGRArrowReader, OGRReader
 
 
 class TestReaders(TestCase):
@@ -31,3 +34,112 @@ class TestReaders(TestCase):
         self.assertEqual(dic['text'], u'three')
         dic = reader.next()
         self.assertEqual(dic['text'], u'two')
+
+    def test_ogr_reader_wkb(self):
+        from django.contrib.gis.geos import GEOSGeometry
+        reader = OGRReader(self.testfilename, geometry_format='wkb')
+        dic = reader.next()
+        self.assertIsInstance(dic['geometry'], (bytes, bytearray))
+        geom = GEOSGeometry(memoryview(dic['geometry']))
+        self.assertEqual(geom.geom_type, 'Point')
+        # OGR rounds WKT coordinates to 15 significant digits
+        self.assertTrue(geom.equals_exact(GEOSGeometry(
+            OGRReader(self.testfilename).next()['geometry']), 1e-12))
+
+    def test_ogr_reader_filters(self):
+        reader = OGRReader(self.testfilename, attribute_filter='zahl = 2')
+        self.assertEqual(reader.next()['text'], u'two')
+        with self.assertRaises(StopIteration):
+            reader.next()
+        reader = OGRReader(
+            self.testfilename, spatial_filter=(-5.48, 1.49, -5.46, 1.51),
+            traditional_axis_order=True)
+        self.assertEqual(reader.next()['text'], u'three')
+        with self.assertRaises(StopIteration):
+            reader.next()
+        reader = OGRReader(self.testfilename, fields=['TEXT'])
+        dic = reader.next()
+        self.assertEqual(dic['text'], u'three')
+        self.assertIsNone(dic['zahl'])
+        self.assertNotIn('geometry', dic)
+
+    def test_ogr_arrow_reader(self):
+        reader = OGRArrowReader(self.testfilename, batch_size=2)
+        expected = OGRReader(self.testfilename)
+        for _ in range(0, 3):
+            # same values and types, e.g. dates as OGR strings
+            self.assertEqual(reader.next(), expected.next())
+        with self.assertRaises(StopIteration):
+            reader.next()
+        self.assertEqual(
+            reader.format_date(datetime(2020, 1, 31, 10, 30, 15, 123000)),
+            '2020/01/31 10:30:15.123')
+        # GDAL < 3.6
+        reader = OGRArrowReader(self.testfilename)
+        reader.supports_arrow = lambda: False
+        self.assertEqual(reader.next(), OGRReader(self.testfilename).next())
+
+    def test_ogr_arrow_batches(self):
+        reader = OGRArrowReader(self.testfilename, batch_size=2)
+        if not reader.supports_arrow():
+            self.skipTest('requires GDAL 3.6')
+        batches = list(reader.batches())
+        self.assertEqual([len(batch['text']) for batch in batches], [2, 1])
+        self.assertEqual(batches[0]['text'], [u'three', u'two'])
+
+    def test_ogr_reader_same_srs(self):
+        self.assertIsNone(OGRReader(
+            self.testfilename, traditional_axis_order=True).transform)
+        self.assertIsNotNone(
+            OGRReader(self.testfilename, target_epsg=3857).transform)
+
+    def test_ogr_reader_axis_order(self):
+        reader = OGRReader(self.testfilename, traditional_axis_order=True)
+        geom = ogr.CreateGeometryFromWkt(reader.next()['geometry'])
+        self.assertAlmostEqual(geom.GetX(), -5.47, places=1)
+        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+            # GDAL 3 defaults to the lat/lon order of EPSG:4326
+            reader = OGRReader(self.testfilename)
+            geom = ogr.CreateGeometryFromWkt(reader.next()['geometry'])
+            self.assertAlmostEqual(geom.GetY(), -5.47, places=1)
+
+    def test_ogr_reader_blocks(self):
+        reader = OGRReader(self.testfilename, target_epsg=3857, block_size=2)
+        expected = OGRReader(self.testfilename, target_epsg=3857)
+        for _ in range(0, 3):
+            self.assertEqual(reader.next(), expected.next())
+        with self.assertRaises(StopIteration):
+            reader.next()
+
+    def test_ogr_reader_blocks_mixed(self):
+        dirname = tempfile.mkdtemp()
+        filename = os.path.join(dirname, 'mixed.gpkg')
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(32632)
+        ds = ogr.GetDriverByName('GPKG').CreateDataSource(filename)
+        layer = ds.CreateLayer('mixed', srs, ogr.wkbUnknown)
+        layer.CreateField(ogr.FieldDefn('text', ogr.OFTString))
+        for number, wkt in enumerate([
+                'POINT (500000 5500000)', 'POINT Z (501000 5501000 10)',
+                'LINESTRING (500000 5500000, 502000 5502000)', None,
+                'POINT (503000 5503000)']):
+            feature = ogr.Feature(layer.GetLayerDefn())
+            feature.SetField('text', text_type(number))
+            if wkt:
+                feature.SetGeometry(ogr.CreateGeometryFromWkt(wkt))
+            layer.CreateFeature(feature)
+        ds = layer = None
+        try:
+            for block_size in [1, 2, 10]:
+                reader = OGRReader(filename, block_size=block_size)
+                expected = OGRReader(filename)
+                self.assertIsNotNone(reader.transform)
+                rows = [reader.next() for _ in range(0, 5)]
+                self.assertEqual(rows, [expected.next() for _ in range(0, 5)])
+                self.assertNotIn('geometry', rows[3])
+                self.assertTrue(rows[1]['geometry'].startswith('POINT'))
+                with self.assertRaises(StopIteration):
+                    reader.next()
+        finally:
+            os.remove(filename)
+            os.rmdir(dirname)
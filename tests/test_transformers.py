@@ -1,6 +1,7 @@
 # Python 3.x compatibility
 from __future__ import absolute_import
 
+import re
 from unittest import TestCase
 from etl_sync.transformations import Transformer
 from django import forms
@@ -123,3 +124,63 @@ class TestTransformer(TestCase):
             'client_employee.organization.name': 'Organization name',
             'client_employee.feedbacks.text': "Feedback",
         })
+
+
+class TestCompiledTransformer(TestCase):
+
+    class BlacklistTransformer(Transformer):
+        mappings = {'name': 'NAME'}
+        blacklist = {'name': [r'^a', r'^b'], 'empty': []}
+
+    def test_cached(self):
+        transformer = self.BlacklistTransformer({})
+        self.assertEqual(transformer.mappings, {'name': 'NAME'})
+        self.assertIs(
+            transformer.mappings, self.BlacklistTransformer({}).mappings)
+        other = self.BlacklistTransformer({})
+        self.assertIs(
+            transformer.get_compiled(
+                'blacklist', transformer._compile_blacklist),
+            other.get_compiled('blacklist', other._compile_blacklist))
+
+    def test_reuse(self):
+        transformer = self.BlacklistTransformer()
+        for name, valid in [('bob', False), ('carl', True), ('al', False)]:
+            transformer.dic = {'NAME': name}
+            self.assertEqual(transformer.is_valid(), valid)
+        self.assertIsNone(transformer.cleaned_data)
+        self.assertIn('^a', str(transformer.error))
+        transformer.dic = {'NAME': 'carl'}
+        self.assertTrue(transformer.is_valid())
+        self.assertEqual(transformer.cleaned_data, {'name': 'carl'})
+        self.assertIsNone(transformer.error)
+        transformer.blacklist = {'name': ['(?i)A']}
+        transformer.dic = {'NAME': 'al'}
+        self.assertFalse(transformer.is_valid())
+        transformer.blacklist = {'name': [r'^a', '(?i)B']}
+        transformer.dic = {'NAME': 'bob'}
+        self.assertFalse(transformer.is_valid())
+        self.assertIn('(?i)B', str(transformer.error))
+
+    def test_blacklist_separate_patterns(self):
+        transformer = Transformer()
+        for blacklist, value in [
+                ([re.compile('^bad', re.I), r'^a'], 'BADNAME'),
+                ([r'(a)\1', r'(b)\1', r'^c'], 'bb')]:
+            transformer.blacklist = {'name': blacklist}
+            transformer.dic = {'name': value}
+            self.assertFalse(transformer.is_valid())
+            transformer.dic = {'name': 'xy'}
+            self.assertTrue(transformer.is_valid())
+
+    def test_relation_paths(self):
+
+        class PathTransformer(Transformer):
+            relation_paths_size = 2
+
+        transformer = PathTransformer()
+        self.assertEqual(transformer.get_relation_path('a.b'), ('a', 'b'))
+        transformer.get_relation_path('c')
+        self.assertEqual(len(PathTransformer._relation_paths), 2)
+        self.assertEqual(transformer.get_relation_path('d.e'), ('d', 'e'))
+        self.assertEqual(PathTransformer._relation_paths, {'d.e': ('d', 'e')})